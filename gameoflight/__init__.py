@@ -0,0 +1,45 @@
+
+# Game of Light
+#       simulation of an LED phototransistor feedback grid
+
+# Nothing is imported until it is first used, so importing the package, or
+#       running one of its modules with python -m, costs no more than what is
+#       asked for (the grid geometry and per-node circuit don't even need numpy)
+#       and never touches pygame, which only the front ends import
+
+import importlib
+
+_EXPORTS = (('grid', ('HEX', 'SQUARE', 'B_3', 'B_6', 'B_4', 'B_HEX', 'B_SQUARE', 'B_FNS',
+                      'DistanceTable', 'ActiveNodes', 'Stencil', 'DiskOffsets', 'WindowSize', 'DotPositions',
+                      'LatticePositions')),
+            ('circuit', ('Id_at_Vd',)),
+            ('engine', ('ArrayEngine', 'GraphEngine', 'GateVoltage', 'InverseResistance', 'DrainVoltage', 'IdAtVd')),
+            ('reference', ('ListEngine', 'CompareWithReference', 'MATCH_TOLERANCE')),
+            ('headless', ('HeadlessRunner',)),
+            ('sweep', ('EnsembleEngine', 'Sweep', 'SweepGrid')),
+            ('packed', ('PackedEngine',)),
+            ('activity', ('ActivityEngine',)),
+            ('integrate', ('ExponentialIntegrator', 'AdaptiveIntegrator', 'CompareWithEuler')),
+            ('snapshot', ('Snapshot', 'MappedEngine')),
+            ('fixed', ('FixedEngine', 'CompareWithFloat')),
+            ('stream', ('FrameServer', 'FrameClient')),
+            ('metrics', ('OnlineMetrics',)),
+            ('cache', ('ResultCache', 'ConfigKey')),
+            ('explore', ('Explore', 'Configs')),
+            ('topology', ('Topology', 'Lattice', 'FromPositions', 'FromEdges')))
+
+_MODULES = dict((name, module) for module, names in _EXPORTS for name in names)
+
+__all__ = [name for module, names in _EXPORTS for name in names]
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
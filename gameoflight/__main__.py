@@ -0,0 +1,147 @@
+
+#                                                       ABOUT
+
+# Headless command line runner
+#       python -m gameoflight --steps 10000 [--show --frame-every 50]
+
+import argparse
+import sys
+
+from .activity import ActivityEngine
+from .convolve import AUTO, BRIGHTNESS_MODES
+from .cycles import CycleDetector
+from .engine import ArrayEngine, MeanCurrent
+from .fixed import FixedEngine
+from .grid import HEX, SQUARE, B_3, B_FNS, WindowSize
+from .headless import HeadlessRunner
+from .integrate import ExponentialIntegrator, AdaptiveIntegrator, TOLERANCE
+from .metrics import OnlineMetrics
+from .packed import PackedEngine
+from .record import Recorder
+from .timing import PhaseTimer, DRAW, NULL_TIMER
+from .snapshot import Save, Snapshot, Resume
+
+ENGINES = {'array': ArrayEngine, 'packed': PackedEngine, 'activity': ActivityEngine, 'fixed': FixedEngine}
+
+
+def ParseArgs(argv):
+    parser = argparse.ArgumentParser(prog='gameoflight', description='Run the Game of Light without a display')
+    parser.add_argument('--steps', type=int, default=1000,
+                        help="Euler steps to run, an integrator takes several per evaluation")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='array')
+    parser.add_argument('--grid', choices=('hex', 'square'), default='hex')
+    parser.add_argument('--width', type=int, default=41)
+    parser.add_argument('--height', type=int, default=41)
+    parser.add_argument('--psr', type=int, default=1)
+    parser.add_argument('--bfn', choices=B_FNS, default=B_3)
+    parser.add_argument('--brightness-mode', choices=BRIGHTNESS_MODES, default=AUTO)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--sensitivity', type=float, default=None)
+    parser.add_argument('--vref-low', type=float, default=None)
+    parser.add_argument('--vref-high', type=float, default=None)
+    parser.add_argument('--integrator', choices=('euler', 'exponential', 'adaptive'), default='euler',
+                        help='exponential and adaptive take several Euler steps per evaluation (array engine only)')
+    parser.add_argument('--substeps', type=int, default=8, help='most Euler steps per step of the exponential integrator')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='vg / vd difference [V] allowed between a macro step and its two halves')
+    parser.add_argument('--flash-steps', type=int, default=100, help='Euler steps to hold the flash light on the grid center')
+    parser.add_argument('--stop-early', action='store_true', help='stop once the board settles or repeats')
+    parser.add_argument('--metrics', action='store_true', help='measure online metrics once the flash light is off')
+    parser.add_argument('--resume', default=None, help='snapshot to resume from, the flash light is skipped')
+    parser.add_argument('--save', default=None, help='snapshot to save when the run ends')
+    parser.add_argument('--record', default=None, help='file to record frames to, see python -m gameoflight.replay')
+    parser.add_argument('--record-every', type=int, default=1, help='steps between recorded frames')
+    parser.add_argument('--profile', default=None, help='file to dump per phase timings to (.csv or .json)')
+    parser.add_argument('--show', action='store_true', help='open a window and draw frames')
+    parser.add_argument('--frame-every', type=int, default=0, help='steps between frames drawn with --show')
+    return parser.parse_args(argv)
+
+
+def BuildEngine(args):
+    grid = HEX if args.grid == 'hex' else SQUARE
+    if args.engine == 'fixed' and (args.save or args.resume):
+        raise SystemExit("--engine fixed can't --save or --resume, snapshots don't support it")
+    if args.resume:
+        engine = Resume(args.resume, ENGINES[args.engine])
+    else:
+        engine = ENGINES[args.engine](args.width, args.height, grid, args.psr, args.bfn, seed=args.seed)
+        if hasattr(engine, 'SetBrightnessMode'):
+            engine.SetBrightnessMode(args.brightness_mode)
+    if args.sensitivity is not None:
+        engine.pSensitivity = args.sensitivity
+    if args.vref_low is not None:
+        engine.pVRefLow = args.vref_low
+    if args.vref_high is not None:
+        engine.pVRefHigh = args.vref_high
+    if args.integrator != 'euler':
+        if args.engine != 'array':
+            raise SystemExit("--integrator %s needs --engine array" % args.integrator)
+        if args.integrator == 'exponential':
+            engine.integrator = ExponentialIntegrator(args.substeps, args.tolerance)
+        else:
+            engine.integrator = AdaptiveIntegrator(args.tolerance)
+    return engine
+
+
+def Main(argv=None):
+    args = ParseArgs(argv)
+    engine = BuildEngine(args)
+    timer = NULL_TIMER
+    if args.profile:
+        timer = engine.timer = PhaseTimer()
+
+    onFrame = None
+    if args.show:
+        import pygame
+        from .render import ArrayRenderer
+        pygame.init()
+        window = pygame.display.set_mode(WindowSize(engine.grid, engine.w, engine.h, 28))
+        renderer = ArrayRenderer(window, engine.w, engine.h, engine.grid)
+
+        def onFrame(engine, step):
+            pygame.event.pump()
+            with timer.Phase(DRAW):
+                rects = renderer.Draw(engine)
+            pygame.display.update(rects)
+
+    # recorded frames come through the same callback, shown ones only every frameEvery
+    frameEvery = args.frame_every
+    recorder = None
+    if args.record:
+        recorder = Recorder(args.record, engine)
+        show = onFrame
+        frameEvery = args.record_every
+
+        def onFrame(engine, step):
+            recorder.Add(engine, step)
+            if show is not None and args.frame_every and step % args.frame_every == 0:
+                show(engine, step)
+
+    detector = CycleDetector() if args.stop_early else None
+    metrics = OnlineMetrics() if args.metrics else None
+    runner = HeadlessRunner(engine, onFrame, frameEvery, detector, metrics)
+    runner.Run(args.steps, flashSteps=0 if args.resume else args.flash_steps)
+    if recorder is not None:
+        recorder.Close()
+        print("recorded %d frames to %s" % (recorder.frames, args.record))
+    print("%d %s in %.2f s (%.1f steps/s), mean iD %.4f" %
+          (runner.steps, 'steps' if args.integrator == 'euler' else 'Euler steps', runner.elapsed,
+           runner.StepRate(), MeanCurrent(engine)))
+    if detector is not None:
+        print(detector.Report())
+    if metrics is not None:
+        print('\n'.join(metrics.Lines()))
+    if args.profile:
+        print('\n'.join(timer.Lines()))
+        timer.Dump(args.profile)
+    if getattr(engine, 'integrator', None) is not None:
+        print(engine.integrator.Report())
+    if args.save:
+        previous = Snapshot(args.resume).steps if args.resume else 0
+        Save(engine, args.save, (previous or 0) + runner.steps)
+        print("saved %s (seed %d)" % (args.save, engine.seed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
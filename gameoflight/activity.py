@@ -0,0 +1,206 @@
+
+#                                                       ABOUT
+
+# Activity-aware sparse stepping
+#       the interior is cut into square tiles and only tiles that are still
+#       changing are stepped, so a board that has mostly settled costs little
+
+# A tile falls asleep once vg, vd and iD have all moved less than threshold
+#       for patience steps in a row. It wakes up again when
+#           - a tile next to it changes iD by threshold or more
+#           - b_ext or active_nodes change anywhere in it or next to it
+#           - a tunable, the brightness function or PowerCycle changes the rules
+# Tiles are always summed directly, an FFT of blocks this small gains nothing
+# With threshold = 0 a tile only sleeps at an exact fixed point and the result
+#       is bit for bit that of an ArrayEngine with brightnessMode DIRECT, with
+#       FFT sums (which AUTO picks for large stencils) or weighted sparse sums
+#       of the whole board it agrees to rounding
+# While more than DENSE_FRACTION of the tiles are awake, gathering them costs
+#       more than it saves and the whole interior is stepped as usual, measuring
+#       tile activity only every DENSE_CHECK_EVERY steps (a step that hands back
+#       to sparse stepping is always measured)
+
+import numpy as np
+
+from .convolve import StencilSum
+from .engine import ArrayEngine, TUNABLES
+from .grid import HEX, B_3
+from .timing import BRIGHTNESS, CIRCUIT, CURRENT
+
+
+DENSE_FRACTION = 0.35
+DENSE_CHECK_EVERY = 4
+
+
+class ActivityEngine(ArrayEngine):
+
+    def __init__(self, w=41, h=41, grid=HEX, psr=1, bFn=B_3, seed=None,
+                 tileSize=8, threshold=1e-9, patience=4):
+        if tileSize < psr:
+            raise ValueError("tiles must be at least PSR = %d nodes wide" % psr)
+        self.tileSize = tileSize
+        self.threshold = threshold
+        self.patience = patience
+        ArrayEngine.__init__(self, w, h, grid, psr, bFn, seed)
+
+        # node coordinates of every tile, tiles on the far edges run past the
+        #       interior and those nodes are masked out by tileValid
+        xs, ys = self.interior
+        t = tileSize
+        x0 = np.arange(xs.start, xs.stop, t)
+        y0 = np.arange(ys.start, ys.stop, t)
+        shape = (len(x0), len(y0))
+        x0, y0 = [a.ravel() for a in np.meshgrid(x0, y0, indexing='ij')]
+        span = np.arange(t)
+        halo = np.arange(-psr, t + psr)
+        self.tileX = np.minimum(x0[:, None] + span, w - 1)
+        self.tileY = np.minimum(y0[:, None] + span, h - 1)
+        self.tileHaloX = np.minimum(x0[:, None] + halo, w - 1)
+        self.tileHaloY = np.minimum(y0[:, None] + halo, h - 1)
+        self.tileValid = (((x0[:, None] + span) < xs.stop)[:, :, None] &
+                          ((y0[:, None] + span) < ys.stop)[:, None, :])
+
+        self.awake = np.ones(shape, dtype=bool)
+        self.quiet = np.zeros(shape, dtype=int)     # consecutive quiet steps per tile
+
+        self.seen_b_ext = self.b_ext.copy()
+        self.seen_active = self.active_nodes.copy()
+        self.seenRules = None
+        self.denseSteps = 0         # dense steps since the last measured one
+
+        self.tileSteps = 0          # tiles stepped so far
+        self.tileStepsSkipped = 0   # tiles left asleep so far
+
+    def WakeAll(self):
+        self.awake[...] = True
+        self.quiet[...] = 0
+
+    def SetBrightnessFn(self, bFn):
+        ArrayEngine.SetBrightnessFn(self, bFn)
+        if hasattr(self, 'awake'):
+            self.WakeAll()
+
+    def PowerCycle(self):
+        ArrayEngine.PowerCycle(self)
+        self.WakeAll()
+
+    def AwakeFraction(self):
+        return self.awake.mean()
+
+    # Wake the tiles in mask (by tile index) and every tile touching them
+    def _WakeAround(self, mask):
+        grown = mask.copy()
+        grown[1:, :] |= mask[:-1, :]
+        grown[:-1, :] |= mask[1:, :]
+        grown[:, 1:] |= grown[:, :-1].copy()
+        grown[:, :-1] |= grown[:, 1:].copy()
+        self.quiet[grown & ~self.awake] = 0
+        self.awake |= grown
+
+    # Tile mask of the nodes where changed is set
+    def _TilesOf(self, changed):
+        x, y = np.nonzero(changed)
+        mask = np.zeros(self.awake.shape, dtype=bool)
+        xs, ys = self.interior
+        x = np.clip(x, xs.start, xs.stop - 1) - xs.start
+        y = np.clip(y, ys.start, ys.stop - 1) - ys.start
+        mask[x // self.tileSize, y // self.tileSize] = True
+        return mask
+
+    def _CheckInputs(self):
+        rules = (self.bFn, self.brightnessMode) + tuple(getattr(self, name) for name in TUNABLES)
+        if rules != self.seenRules:
+            self.seenRules = rules
+            self.WakeAll()
+        changed = (self.b_ext != self.seen_b_ext) | (self.active_nodes != self.seen_active)
+        if changed.any():
+            self._WakeAround(self._TilesOf(changed))
+            self.seen_b_ext[...] = self.b_ext
+            self.seen_active[...] = self.active_nodes
+
+    def Step(self):
+        self._CheckInputs()
+        if self.awake.mean() > DENSE_FRACTION:
+            self.denseSteps += 1
+            if self.denseSteps >= DENSE_CHECK_EVERY:
+                self._DenseStep()
+            else:
+                ArrayEngine.Step(self)
+                self.tileSteps += self.awake.size
+        elif self.denseSteps:
+            self._DenseStep()
+        else:
+            self._SparseStep()
+
+    # Largest value of a field over the interior in each tile, flattened
+    def _TileMax(self, field):
+        t = self.tileSize
+        nx, ny = self.awake.shape
+        padded = np.zeros((nx * t, ny * t))
+        padded[:field.shape[0], :field.shape[1]] = field
+        return padded.reshape(nx, t, ny, t).max(axis=(1, 3)).ravel()
+
+    # Step everything, then measure how far each tile moved
+    def _DenseStep(self):
+        xs, ys = self.interior
+        vg, vd, iD = self.vg[xs, ys].copy(), self.vd[xs, ys].copy(), self.iD[xs, ys].copy()
+        ArrayEngine.Step(self)
+        self.tileSteps += self.awake.size
+        self.denseSteps = 0
+
+        iDChange = self._TileMax(np.abs(self.iD[xs, ys] - iD))
+        change = np.maximum(self._TileMax(np.abs(self.vg[xs, ys] - vg)),
+                            self._TileMax(np.abs(self.vd[xs, ys] - vd)))
+        self._Settle(np.arange(self.awake.size), np.maximum(change, iDChange), iDChange)
+
+    # Awake tiles are gathered into one (tiles, tileSize, tileSize) batch and
+    #       stepped with the same array operations as ArrayEngine.Step()
+    def _SparseStep(self):
+        tiles = np.flatnonzero(self.awake)
+        self.tileSteps += len(tiles)
+        self.tileStepsSkipped += self.awake.size - len(tiles)
+        if not len(tiles):
+            return
+
+        X = self.tileX[tiles][:, :, None]
+        Y = self.tileY[tiles][:, None, :]
+        valid = self.tileValid[tiles]
+        active = self.active_nodes[X, Y] & valid
+        p, t = self.psr, self.tileSize
+
+        with self.timer.Phase(BRIGHTNESS):
+            iDHalo = self.iD[self.tileHaloX[tiles][:, :, None], self.tileHaloY[tiles][:, None, :]]
+            light = StencilSum(iDHalo, self.convolver.stencil, slice(p, p + t), slice(p, p + t))
+        vg, vd, iD = self.vg[X, Y], self.vd[X, Y], self.iD[X, Y]
+        with self.timer.Phase(CIRCUIT):
+            b, vgNew, rqi, vdNew = self.CircuitStep(light, self.b_ext[X, Y], vg, vd, iD,
+                                                    active, self.pSensVariation[X, Y])
+        with self.timer.Phase(CURRENT):
+            iDNew = self.CurrentStep(vdNew, active, self.idVariation[X, Y])
+
+        Xv, Yv = np.broadcast_to(X, valid.shape)[valid], np.broadcast_to(Y, valid.shape)[valid]
+        self.b[Xv, Yv] = b[valid]
+        self.vg[Xv, Yv] = vgNew[valid]
+        self.rqi[Xv, Yv] = rqi[valid]
+        self.vd[Xv, Yv] = vdNew[valid]
+        self.iD[Xv, Yv] = iDNew[valid]
+
+        # how far each tile moved this step
+        iDChange = np.where(valid, np.abs(iDNew - iD), 0).max(axis=(1, 2))
+        change = np.maximum(np.where(valid, np.abs(vgNew - vg), 0).max(axis=(1, 2)),
+                            np.where(valid, np.abs(vdNew - vd), 0).max(axis=(1, 2)))
+        self._Settle(tiles, np.maximum(change, iDChange), iDChange)
+
+    # Put tiles that stayed quiet long enough to sleep and wake the
+    #       neighbors of tiles whose LEDs changed
+    def _Settle(self, tiles, change, iDChange):
+        quiet = self.quiet.ravel()
+        moving = change > self.threshold
+        quiet[tiles[moving]] = 0
+        quiet[tiles[~moving]] += 1
+        self.awake.ravel()[tiles[quiet[tiles] >= self.patience]] = False
+
+        lit = np.zeros(self.awake.size, dtype=bool)
+        lit[tiles[iDChange > self.threshold]] = True
+        if lit.any():
+            self._WakeAround(lit.reshape(self.awake.shape))
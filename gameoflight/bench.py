@@ -0,0 +1,203 @@
+
+#                                                       ABOUT
+
+# Benchmark suite
+#       times Step() of each engine over both grid types, a range of board
+#       sizes, every brightness function and several PSRs, all from the same
+#       seed, and compares throughput and peak memory against a stored baseline
+
+# python -m gameoflight.bench --quick --save-baseline bench_baseline.json
+# python -m gameoflight.bench --quick --baseline bench_baseline.json
+
+# Every case runs the flash light on the grid center for a warm up, then
+#       steps for about NODE_STEPS node updates (at least MIN_STEPS steps) in
+#       REPEATS blocks, and the fastest block counts
+# Peak memory is measured separately with tracemalloc, which slows numpy
+#       allocation down, over construction and MEMORY_STEPS steps, it only sees
+#       this process, so TiledEngine's shared memory and workers aren't counted
+# A case is a regression when its throughput falls or its peak memory grows
+#       by more than the tolerance, and is flagged as changed when its final
+#       mean LED current differs, which means the physics changed
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .activity import ActivityEngine
+from .engine import ArrayEngine, MeanCurrent
+from .grid import HEX, SQUARE, B_3, B_6, B_4, B_HEX, B_SQUARE
+from .packed import PackedEngine
+from .parallel import TiledEngine
+from .reference import ListEngine
+
+
+#                                                       CONSTANTS
+
+BENCH_SEED = 1234
+
+BENCH_ENGINES = {'array': ArrayEngine, 'packed': PackedEngine, 'activity': ActivityEngine, 'tiled': TiledEngine,
+                 'list': ListEngine}
+
+# Limits for the per-node reference port, ~5 us per node update: boards up to
+#       ENGINE_MAX_SIZE and at most ENGINE_NODE_STEPS node updates timed per case
+ENGINE_MAX_SIZE = {'list': 201}
+ENGINE_NODE_STEPS = {'list': 2e5}
+
+# Brightness functions of each grid, those that only reach adjacent LEDs are
+#       only run at PSR 1 as a wider border doesn't change their work
+GRID_B_FNS = {HEX: (B_3, B_6, B_HEX), SQUARE: (B_4, B_SQUARE)}
+ADJACENT_B_FNS = (B_3, B_6, B_4)
+GRID_NAMES = {HEX: 'hex', SQUARE: 'square'}
+
+SIZES = (41, 201, 1001, 3001)
+QUICK_SIZES = (41, 201)
+PSRS = (1, 2, 4)
+
+NODE_STEPS = 5e6        # node updates timed per case
+MIN_STEPS = 6
+REPEATS = 3
+WARMUP_STEPS = 20
+MEMORY_STEPS = 2
+TOLERANCE = 0.15        # fraction throughput may drop or memory grow before a regression
+MATCH_RTOL = 1e-9       # relative change in mean iD that counts as changed physics
+
+
+# Every (engine, grid, size, bFn, psr) combination to run
+def Cases(engines, grids, sizes, psrs):
+    cases = []
+    for engine in engines:
+        for grid in grids:
+            for size in sizes:
+                if size > ENGINE_MAX_SIZE.get(engine, size):
+                    continue
+                for bFn in GRID_B_FNS[grid]:
+                    for psr in ((1,) if bFn in ADJACENT_B_FNS else psrs):
+                        cases.append((engine, grid, size, bFn, psr))
+    return cases
+
+
+def CaseKey(engine, grid, size, bFn, psr):
+    return "%s/%s/%d/%s/psr%d" % (engine, GRID_NAMES[grid], size, bFn, psr)
+
+
+def _Build(engine, grid, size, bFn, psr, seed):
+    e = BENCH_ENGINES[engine](size, size, grid, psr, bFn, seed=seed)
+    e.useVariation = True
+    e.FlashLight(size // 2, size // 2, max(2, size // 20), 140)
+    return e
+
+
+# Stop an engine's worker processes, TiledEngine's
+def _Close(e):
+    if hasattr(e, 'Close'):
+        e.Close()
+
+
+# Time one case, returns a result row
+def RunCase(engine, grid, size, bFn, psr, seed=BENCH_SEED, nodeSteps=NODE_STEPS):
+    start = time.perf_counter()
+    e = _Build(engine, grid, size, bFn, psr, seed)
+    setup = time.perf_counter() - start
+
+    for i in range(WARMUP_STEPS):
+        e.Step()
+    e.ClearFlashLight()
+    nodes = (size - 2 * psr) ** 2
+    nodeSteps = min(nodeSteps, ENGINE_NODE_STEPS.get(engine, nodeSteps))
+    block = max(MIN_STEPS, int(nodeSteps / nodes)) // REPEATS
+    steps = block * REPEATS
+    elapsed = None
+    for k in range(REPEATS):
+        start = time.perf_counter()
+        for i in range(block):
+            e.Step()
+        elapsed = min(elapsed or np.inf, (time.perf_counter() - start) * REPEATS)
+    meanCurrent = MeanCurrent(e)
+    _Close(e)
+    del e
+
+    tracemalloc.start()
+    e = _Build(engine, grid, size, bFn, psr, seed)
+    for i in range(MEMORY_STEPS):
+        e.Step()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    _Close(e)
+    del e
+
+    return {'case': CaseKey(engine, grid, size, bFn, psr), 'engine': engine, 'grid': GRID_NAMES[grid],
+            'size': size, 'bFn': bFn, 'psr': psr, 'steps': steps, 'setup_s': setup,
+            'steps_per_s': steps / elapsed, 'mnode_steps_per_s': steps * nodes / elapsed / 1e6,
+            'peak_mb': peak / 1e6, 'mean_iD': meanCurrent}
+
+
+# Compare rows against baseline rows, returns (regressions, changed) lists of messages
+#       mean iD is only compared with currents, runs from the same seed
+def Compare(rows, baseline, tolerance=TOLERANCE, currents=True):
+    base = dict((row['case'], row) for row in baseline)
+    regressions, changed = [], []
+    for row in rows:
+        old = base.get(row['case'])
+        if old is None:
+            continue
+        if row['steps_per_s'] < old['steps_per_s'] * (1 - tolerance):
+            regressions.append("%s: %.1f steps/s, baseline %.1f" % (row['case'], row['steps_per_s'], old['steps_per_s']))
+        if row['peak_mb'] > old['peak_mb'] * (1 + tolerance):
+            regressions.append("%s: %.1f MB peak, baseline %.1f" % (row['case'], row['peak_mb'], old['peak_mb']))
+        if currents and old['steps'] == row['steps'] and not np.isclose(row['mean_iD'], old['mean_iD'], rtol=MATCH_RTOL, atol=0):
+            changed.append("%s: mean iD %.9g, baseline %.9g" % (row['case'], row['mean_iD'], old['mean_iD']))
+    return regressions, changed
+
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='gameoflight.bench', description='Game of Light benchmark suite')
+    parser.add_argument('--engines', nargs='+', choices=sorted(BENCH_ENGINES), default=['array'])
+    parser.add_argument('--grids', nargs='+', choices=('hex', 'square'), default=['hex', 'square'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=None)
+    parser.add_argument('--psrs', nargs='+', type=int, default=list(PSRS))
+    parser.add_argument('--quick', action='store_true', help='sizes %s only' % (QUICK_SIZES,))
+    parser.add_argument('--node-steps', type=float, default=NODE_STEPS, help='node updates timed per case')
+    parser.add_argument('--seed', type=int, default=BENCH_SEED)
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--save-baseline', default=None, help='write the results as a baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    grids = [HEX if name == 'hex' else SQUARE for name in args.grids]
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    rows = []
+    print("%-36s %8s %12s %10s %9s %9s" % ('case', 'steps', 'steps/s', 'Mnode/s', 'peak MB', 'setup s'))
+    for case in Cases(args.engines, grids, sizes, args.psrs):
+        row = RunCase(*case, seed=args.seed, nodeSteps=args.node_steps)
+        rows.append(row)
+        print("%-36s %8d %12.1f %10.2f %9.1f %9.2f" % (row['case'], row['steps'], row['steps_per_s'],
+                                                        row['mnode_steps_per_s'], row['peak_mb'], row['setup_s']))
+        sys.stdout.flush()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'seed': args.seed, 'results': rows}, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sameSeed = baseline.get('seed') == args.seed
+        if not sameSeed:
+            print("baseline was run with seed %s, mean iD can't be compared" % baseline.get('seed'))
+        regressions, changed = Compare(rows, baseline['results'], args.tolerance, sameSeed)
+        for line in changed:
+            print("changed     " + line)
+        for line in regressions:
+            print("regression  " + line)
+        if not regressions and not changed:
+            print("no regressions against %s" % args.baseline)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,135 @@
+
+#                                                       ABOUT
+
+# Content addressed result cache
+#       results of runs kept on disk under the hash of everything that went
+#       into them: the full configuration and the version of the code
+
+# An entry is a directory named by its key holding summary.json and the final
+#       snapshot (snapshot.Save) of the run, written to a temporary directory
+#       and renamed into place, so workers can fill the cache side by side and
+#       a reader never sees half an entry
+# The cache is kept under maxBytes by evicting the least recently used
+#       entries, reading an entry counts as using it
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from .snapshot import Save
+
+
+#                                                       CONSTANTS
+
+CACHE_DIR = os.environ.get('GAMEOFLIGHT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'gameoflight'))
+CACHE_MAX_BYTES = 1 << 30
+
+SUMMARY_FILE = 'summary.json'
+SNAPSHOT_FILE = 'final.snap'
+
+_codeVersion = None
+
+
+# Hash of the package's sources, any change to them makes new keys
+def CodeVersion():
+    global _codeVersion
+    if _codeVersion is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(here)):
+            if name.endswith('.py'):
+                digest.update(name.encode('utf-8'))
+                with open(os.path.join(here, name), 'rb') as f:
+                    digest.update(f.read())
+        _codeVersion = digest.hexdigest()[:16]
+    return _codeVersion
+
+
+# Key of a configuration, a dict of plain JSON values
+def ConfigKey(config):
+    text = json.dumps({'config': config, 'code': CodeVersion()}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _Size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class ResultCache(object):
+
+    def __init__(self, directory=CACHE_DIR, maxBytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    def Path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    # Summary stored under key, None if there is none
+    def Get(self, key):
+        path = os.path.join(self.Path(key), SUMMARY_FILE)
+        try:
+            with open(path) as f:
+                summary = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return summary
+
+    def SnapshotPath(self, key):
+        return os.path.join(self.Path(key), SNAPSHOT_FILE)
+
+    # Store a run's summary and final engine state under key
+    def Put(self, key, summary, engine=None, steps=None):
+        final = self.Path(key)
+        parent = os.path.dirname(final)
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.' + key[:8], dir=parent)
+        try:
+            if engine is not None:
+                Save(engine, os.path.join(staging, SNAPSHOT_FILE), steps)
+            with open(os.path.join(staging, SUMMARY_FILE), 'w') as f:
+                json.dump(summary, f, sort_keys=True)
+            try:
+                os.rename(staging, final)
+            except OSError:
+                pass        # another worker got there first with the same result
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+    # (last used, bytes, path) of every entry
+    def Entries(self):
+        entries = []
+        for shard in os.listdir(self.directory):
+            shardPath = os.path.join(self.directory, shard)
+            if not os.path.isdir(shardPath):
+                continue
+            for key in os.listdir(shardPath):
+                path = os.path.join(shardPath, key)
+                summary = os.path.join(path, SUMMARY_FILE)
+                if key.startswith('.') or not os.path.exists(summary):
+                    continue
+                entries.append((os.path.getmtime(summary), _Size(path), path))
+        return entries
+
+    def Size(self):
+        return sum(size for used, size, path in self.Entries())
+
+    # Drop least recently used entries until the cache fits in maxBytes, returns how many went
+    def Evict(self):
+        entries = sorted(self.Entries())
+        total = sum(size for used, size, path in entries)
+        evicted = 0
+        for used, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+        return evicted
@@ -0,0 +1,54 @@
+
+#                                                       ABOUT
+
+# Circuit constants for the LED / phototransistor node and the default
+#       tunables the simulation starts with
+
+
+#                                                       CONSTANTS
+
+VDD = 5.0             # Vdd potential [V]
+VN = 1.5              # A bit less than Vgth for N channel FET [V] 1.2 is minimum for affordable N-FET
+VP = VDD - 1.5        # A bit more than Vgth for P channel FET [V] VDD - 1.2 is maximum for affordable P-FET
+
+RQ_ON = 10          # Minimum combined FET on-resistance (Vgs = VDD / 2) [Ohm]
+                    #       Will be 10Ohm at most, willing to pay for down to 1.2Ohm
+RQI_BASE = 1000 / ((VP - VN)/2)**2 / RQ_ON # pre-calc'd inverse base resistance [1/kOhm] for RQi fn
+
+VG_MIN = -15.0       # Min Voltage for phototrans circuit [v]
+VG_MAX = 10.0       # Max Voltage for phototrans cirucit [V]
+
+QA = 2.604213#pfit[0] #quadratic poly fit
+QB = -7.08313#pfit[1]
+QC = 2.776874#pfit[2]
+SLOPE = 0.17421485#Id_data[1]/Vc_data[1] #slope in linear region
+V_Q_TH = 2.3860976#Vc_data[2] #minimum voltage for quadratic region
+
+STEP_SCALE_BASE = 1.1   # base for gate and LED step scales
+
+
+#                                                       DEFAULT TUNABLES
+
+# Step Scales are a cheap way of factoring in effect of capacitances needed
+#       at FET gates and drains (phototrans divider tied to gatesm, LED between drains)
+# Valid Step Scales between 0 and 1
+VG_STEP_SCALE = STEP_SCALE_BASE**(-19)
+VD_STEP_SCALE = STEP_SCALE_BASE**(-53)
+
+P_SENSITIVITY = 0.085   # Phototransistor Sensitivity - Brightness to Steady State Gate Voltage
+P_VREF_LOW = -0.6       # phototransistor circuit low voltage reference
+P_VREF_HIGH = 4.95      # phototransistor circuit high voltage reference
+
+
+#                                                       Circuit functions
+
+# LED current (proportional to brightness) at Cap voltage
+def Id_at_Vd(v):
+    if (v > V_Q_TH):
+        return QA*v**2 + QB*v + QC
+    return SLOPE*v
+
+
+# Per-device variation field of rand(0.9, 1.1), indexed [x][y]
+def VariationField(w, h, rng):
+    return [[rng.random()*0.2 + 0.9 for i in range(h)] for j in range(w)]
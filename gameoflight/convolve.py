@@ -0,0 +1,148 @@
+
+#                                                       ABOUT
+
+# Brightness summing as a convolution
+#       a stencil compiled into a (2 PSR + 1) x (2 PSR + 1) kernel over [x][y]
+#       offsets, hex-skewed for the hex grid just like the d table, summed either
+#       directly as shifted arrays or with one FFT convolution of iD
+
+# Direct sums cost one array add per stencil tap, the FFT a roughly fixed
+#       amount per node, so "auto" switches to the FFT once the stencil has
+#       enough taps for the size of the block it sums, see FFT_CROSSOVER
+# FFT sums agree with direct sums to about 1e-12 of the brightness, not bit for bit
+# "sparse" sums with the stencil compiled into a sensing graph, one gather and
+#       row sum per step (topology.StencilGraph), bit for bit for unweighted
+#       stencils and to rounding for weighted ones
+
+import numpy as np
+
+from .topology import StencilGraph
+
+
+#                                                       CONSTANTS
+
+DIRECT = 'direct'
+FFT = 'fft'
+SPARSE = 'sparse'
+AUTO = 'auto'
+
+BRIGHTNESS_MODES = (AUTO, DIRECT, FFT, SPARSE)
+
+# (largest block area, stencil taps from which an FFT beats shifted sums)
+#       fitted to best of 5 timings of B_hex and B_square at PSR 2 / 4 / 6 on
+#       41 x 41 up to 1501 x 1501 boards, the crossover was 22 - 31 taps up to
+#       101 x 101, 41 - 59 from 151 x 151 to 301 x 301 where the shifted sums
+#       still fit in cache, and 23 - 36 above that
+FFT_CROSSOVER = ((128 * 128, 32),
+                 (384 * 384, 56),
+                 (None, 40))
+
+
+# Sum of a field over the stencil offsets for every node in the region (xs, ys)
+#       any leading axes of field are carried along untouched
+def StencilSum(field, stencil, xs, ys):
+    light = None
+    for weight, offsets in stencil:
+        group = None
+        for dx, dy in offsets:
+            shifted = field[..., xs.start + dx:xs.stop + dx, ys.start + dy:ys.stop + dy]
+            if group is None:
+                group = shifted.copy()
+            else:
+                group += shifted
+        if weight != 1.0:
+            group *= weight
+        if light is None:
+            light = group
+        else:
+            light += group
+    return light
+
+
+# Kernel K with K[psr + dx][psr + dy] = weight of the LED at offset (dx, dy)
+def StencilKernel(stencil, psr):
+    kernel = np.zeros((2 * psr + 1, 2 * psr + 1))
+    for weight, offsets in stencil:
+        for dx, dy in offsets:
+            kernel[psr + dx, psr + dy] += weight
+    return kernel
+
+
+# Smallest 2^a 3^b 5^c >= n, lengths numpy's FFT is fast at
+def FastLength(n):
+    best = 1
+    while best < n:
+        best *= 2
+    power5 = 1
+    while power5 < best:
+        power3 = power5
+        while power3 < best:
+            length = power3
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power3 *= 3
+        power5 *= 5
+    return best
+
+
+def StencilTaps(stencil):
+    return sum(len(offsets) for weight, offsets in stencil)
+
+
+# DIRECT or FFT, whichever FFT_CROSSOVER says is faster for a stencil of
+#       taps taps summed over a block of area nodes
+def AutoMode(taps, area):
+    for maxArea, minTaps in FFT_CROSSOVER:
+        if maxArea is None or area <= maxArea:
+            return FFT if taps >= minTaps else DIRECT
+
+
+class Convolver(object):
+
+    def __init__(self, stencil, psr, mode=AUTO):
+        if mode not in BRIGHTNESS_MODES:
+            raise ValueError("unknown brightness mode: %r" % (mode,))
+        self.stencil = stencil
+        self.psr = psr
+        self.kernel = StencilKernel(stencil, psr)
+        self.taps = StencilTaps(stencil)
+        self.mode = mode
+        self.kernelFFT = {}         # kernel spectrum per block shape
+        self.graphs = {}            # sensing graph per board shape and region
+
+    # Light sensed over the region (xs, ys) of field, leading axes carried along
+    def Sum(self, field, xs, ys):
+        mode = self.mode
+        if mode == AUTO:
+            mode = AutoMode(self.taps, (xs.stop - xs.start + 2 * self.psr) * (ys.stop - ys.start + 2 * self.psr))
+        if mode == DIRECT:
+            return StencilSum(field, self.stencil, xs, ys)
+        if mode == SPARSE:
+            return self.SparseSum(field, xs, ys)
+        return self.FFTSum(field, xs, ys)
+
+    # Sensing graph of the region times iD over the flattened board
+    def SparseSum(self, field, xs, ys):
+        w, h = field.shape[-2:]
+        key = (w, h, xs.start, xs.stop, ys.start, ys.stop)
+        graph = self.graphs.get(key)
+        if graph is None:
+            graph = self.graphs[key] = StencilGraph(self.stencil, (w, h), xs, ys)
+        light = graph.Sense(field.reshape(field.shape[:-2] + (w * h,)))
+        return light.reshape(field.shape[:-2] + (xs.stop - xs.start, ys.stop - ys.start))
+
+    # Valid part of a circular FFT convolution of the block the region senses
+    #       with the flipped kernel, zero padded to 5-smooth lengths, which
+    #       only wraps around into the 2 PSR rows and columns thrown away
+    def FFTSum(self, field, xs, ys):
+        p = self.psr
+        block = field[..., xs.start - p:xs.stop + p, ys.start - p:ys.stop + p]
+        w, h = block.shape[-2:]
+        shape = (FastLength(w), FastLength(h))
+        spectrum = self.kernelFFT.get(shape)
+        if spectrum is None:
+            spectrum = np.fft.rfft2(self.kernel[::-1, ::-1], shape)
+            self.kernelFFT[shape] = spectrum
+        light = np.fft.irfft2(np.fft.rfft2(block, shape) * spectrum, shape)
+        return light[..., 2 * p:w, 2 * p:h]
@@ -0,0 +1,130 @@
+
+#                                                       ABOUT
+
+# Fixed point and cycle detection
+#       hashes iD and vd, quantized, after every observed step and keeps a
+#       rolling history of the hashes to spot the board repeating itself
+
+# A board is periodic with period p once every hash over the last confirm
+#       periods matched the one p steps before it, the transient is the step the
+#       repetition started at, a fixed point is period 1
+# Quantizing makes a board that is still creeping towards a fixed point hash
+#       the same from step to step, so settling shows up as soon as nothing
+#       moves by a whole quantum any more
+# Ensembles are tracked member by member, Observe() is True once all are known
+
+import collections
+import hashlib
+
+import numpy as np
+
+from .engine import DenseField
+from .record import ID_QUANTUM
+
+
+#                                                       CONSTANTS
+
+VD_QUANTUM = 1e-3           # [V]
+
+HISTORY = 1024              # hashes kept per member, the longest period that can be seen
+CONFIRM = 2                 # periods that must repeat before a cycle is reported
+
+
+# iD and vd of any engine as [..., x, y] arrays
+def _Fields(engine):
+    return DenseField(engine, 'iD'), DenseField(engine, 'vd')
+
+
+class _Track(object):
+
+    def __init__(self, history):
+        # one more than history, so a period of history still has the
+        #       observation before its first repeat to measure from
+        self.hashes = collections.deque(maxlen=history + 1)
+        self.steps = collections.deque(maxlen=history + 1)
+        self.last = {}          # hash -> count of observations when it was last seen, in the history only
+        self.count = 0
+        self.lag = 0            # candidate period in observations
+        self.run = 0            # observations in a row that matched lag back
+        self.period = None
+        self.transient = None
+
+    def Add(self, digest, step, confirm):
+        if len(self.hashes) == self.hashes.maxlen:
+            # the oldest observation falls out of the history, and its hash
+            #       with it unless it was seen again since
+            oldest = self.hashes[0]
+            if self.last.get(oldest) == self.count - len(self.hashes):
+                del self.last[oldest]
+        seen = self.last.get(digest)
+        if self.lag and len(self.hashes) >= self.lag and self.hashes[-self.lag] == digest:
+            self.run += 1
+        elif seen is not None:
+            self.lag = self.count - seen
+            self.run = 1
+        else:
+            self.lag = self.run = 0
+
+        self.hashes.append(digest)
+        self.steps.append(step)
+        self.last[digest] = self.count
+        self.count += 1
+
+        if self.lag and self.run >= confirm * self.lag:
+            # the first matching observation repeated the one lag before it
+            first = len(self.steps) - self.run - self.lag
+            self.transient = self.steps[first] if first >= 0 else self.steps[0]
+            self.period = step - self.steps[-1 - self.lag]
+            return True
+        return False
+
+
+class CycleDetector(object):
+
+    def __init__(self, idQuantum=ID_QUANTUM, vdQuantum=VD_QUANTUM, history=HISTORY, confirm=CONFIRM):
+        self.idQuantum = idQuantum
+        self.vdQuantum = vdQuantum
+        self.history = history
+        self.confirm = confirm
+        self.tracks = None
+
+    # Digest of each member's quantized board
+    def Hashes(self, engine):
+        iD, vd = _Fields(engine)
+        members = int(np.prod(iD.shape[:-2], dtype=int))
+        levels = np.concatenate((np.floor(iD * (1 / self.idQuantum)).reshape(members, -1),
+                                 np.floor(vd * (1 / self.vdQuantum)).reshape(members, -1)), axis=1)
+        levels = levels.astype(np.int32)
+        return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in levels]
+
+    # Hash the board as it is after step, True once every member's behavior is known
+    def Observe(self, engine, step):
+        hashes = self.Hashes(engine)
+        if self.tracks is None:
+            self.tracks = [_Track(self.history) for digest in hashes]
+        for track, digest in zip(self.tracks, hashes):
+            if track.period is None:
+                track.Add(digest, step, self.confirm)
+        return self.Known()
+
+    def Known(self):
+        return self.tracks is not None and all(track.period is not None for track in self.tracks)
+
+    # Periods and transients in steps, one per member, None while still unknown
+    def Periods(self):
+        return [track.period for track in self.tracks or []]
+
+    def Transients(self):
+        return [track.transient for track in self.tracks or []]
+
+    def Report(self):
+        lines = []
+        for k, track in enumerate(self.tracks or []):
+            if track.period is None:
+                text = "no repeat yet"
+            elif track.period == 1:
+                text = "fixed point from step %d" % track.transient
+            else:
+                text = "period %d from step %d" % (track.period, track.transient)
+            lines.append(text if len(self.tracks) == 1 else "member %d: %s" % (k, text))
+        return '\n'.join(lines)
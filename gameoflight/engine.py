@@ -0,0 +1,284 @@
+
+#                                                       ABOUT
+
+# Vectorized step engine
+#       keeps the whole grid state as contiguous [x][y] arrays and steps every
+#       node at once with shifted-array sums and masked array operations
+
+# One step matches the per-node reference engine (reference.ListEngine) to
+#       within reference.MATCH_TOLERANCE, see reference.CompareWithReference
+
+import numpy as np
+
+from .circuit import (VDD, VN, VP, RQI_BASE, QA, QB, QC, SLOPE, V_Q_TH,
+                      VG_STEP_SCALE, VD_STEP_SCALE, P_SENSITIVITY, P_VREF_LOW, P_VREF_HIGH)
+from .convolve import AUTO, Convolver
+from .grid import HEX, B_3, ActiveNodes, DiskOffsets, Stencil, StencilReach
+from .timing import NULL_TIMER, BRIGHTNESS, CIRCUIT, CURRENT
+
+
+#                                                       Array circuit functions
+
+# Gate voltage (approaches light + pVRefLow, capped at pVRefHigh)
+def GateVoltage(vg, light, pVRefLow, pVRefHigh, vgStepScale):
+    vg = vg + (light + pVRefLow - vg) * vgStepScale
+    return np.minimum(vg, pVRefHigh, out=vg)
+
+
+# Inverse of combined FET resistance
+def InverseResistance(vg):
+    rqi = (vg - VN)*(VP - vg) * RQI_BASE
+    return np.maximum(rqi, 0, out=rqi)
+
+
+# Voltage between FET drains (voltage across LED + current limiting resistor)
+def DrainVoltage(vd, rqi, iD, vdStepScale):
+    vd = vd + ((VDD - vd)*rqi - iD) * vdStepScale
+    return np.minimum(vd, VDD, out=vd)
+
+
+# LED current (proportional to brightness) at Cap voltage
+def IdAtVd(v):
+    return np.where(v > V_Q_TH, QA*v**2 + QB*v + QC, SLOPE*v)
+
+
+#                                                       Engine
+
+# Fresh seed for the per-device variation fields, drawn when none is given so
+#       that every run records the seed it can be reproduced from
+def NewSeed():
+    return int(np.random.SeedSequence().entropy % 2**32)
+
+
+STATE_FIELDS = ('b', 'vg', 'rqi', 'vd', 'iD')
+
+_diskMasks = {}
+
+
+# Flash light / toggle tool of radius r as a (2r + 1) x (2r + 1) mask centered
+#       on the node, worked out once per grid and radius
+def DiskMask(grid, r):
+    key = (grid, r)
+    if key not in _diskMasks:
+        mask = np.zeros((2 * r + 1, 2 * r + 1), dtype=bool)
+        for i, j in DiskOffsets(grid, r):
+            mask[i + r, j + r] = True
+        _diskMasks[key] = mask
+    return _diskMasks[key]
+
+
+# The tool of radius r centered on node (x, y) clipped to a w x h board
+#       returns the board slices it covers and the matching part of its mask
+def ClippedDisk(grid, r, x, y, w, h):
+    x0, x1 = max(x - r, 0), min(x + r + 1, w)
+    y0, y1 = max(y - r, 0), min(y + r + 1, h)
+    if x0 >= x1 or y0 >= y1:
+        return None, None
+    mask = DiskMask(grid, r)[x0 - x + r:x1 - x + r, y0 - y + r:y1 - y + r]
+    return (slice(x0, x1), slice(y0, y1)), mask
+
+
+# A state field of any engine as a float [..., x][y] board array, PackedEngine
+#       scatters its packed fields and FixedEngine scales its codes
+def DenseField(engine, name):
+    if hasattr(engine, 'Dense'):
+        return engine.Dense(name)
+    return getattr(engine, name)
+
+
+# Mean LED current of any engine over the active nodes it steps, those off
+#       the PSR border, reference.ListEngine's nested lists included
+def MeanCurrent(engine):
+    psr = engine.psr
+    xs, ys = slice(psr, engine.w - psr), slice(psr, engine.h - psr)
+    active = np.asarray(engine.active_nodes, dtype=bool)[xs, ys]
+    return float(np.asarray(DenseField(engine, 'iD'))[..., xs, ys][..., active].mean())
+
+# Settings that can be changed between steps
+TUNABLES = ('pSensitivity', 'pVRefLow', 'pVRefHigh', 'vgStepScale', 'vdStepScale', 'useVariation')
+
+
+class ArrayEngine(object):
+
+    batchShape = ()     # leading axes of the state arrays, see sweep.EnsembleEngine
+    brightnessMode = AUTO   # shifted sums or FFT convolution, see convolve.Convolver
+    integrator = None       # None for plain Euler steps, see integrate.py
+    timer = NULL_TIMER      # per phase step timing, see timing.PhaseTimer
+
+    def __init__(self, w=41, h=41, grid=HEX, psr=1, bFn=B_3, seed=None):
+        self.w = w
+        self.h = h
+        self.grid = grid
+        self.psr = psr
+        self.seed = seed = NewSeed() if seed is None else seed
+
+        self.vgStepScale = VG_STEP_SCALE
+        self.vdStepScale = VD_STEP_SCALE
+        self.pSensitivity = P_SENSITIVITY
+        self.pVRefLow = P_VREF_LOW
+        self.pVRefHigh = P_VREF_HIGH
+        self.useVariation = False
+
+        # all active nodes exist from PSR to W - PSR - 1 and PSR to H - PSR - 1
+        self.interior = (slice(psr, w - psr), slice(psr, h - psr))
+
+        # b, vg, rqi, vd and iD stacked in one array, each with batchShape
+        #       leading axes in front of [x][y]
+        self.state = self.NewArray('state', (len(STATE_FIELDS),) + self.batchShape + (w, h))
+        self.b, self.vg, self.rqi, self.vd, self.iD = self.state
+        self.b_ext = self.NewArray('b_ext', self.batchShape + (w, h))
+        self.active_nodes = self.NewArray('active_nodes', (w, h), bool)
+
+        rng = np.random.RandomState(seed)
+        self.pSensVariation = self.NewArray('pSensVariation', (w, h))
+        self.pSensVariation[...] = rng.random_sample((w, h)) * 0.2 + 0.9
+        self.idVariation = self.NewArray('idVariation', (w, h))
+        self.idVariation[...] = rng.random_sample((w, h)) * 0.2 + 0.9
+
+        self.SetBrightnessFn(bFn)
+        self.ResetActiveNodes()
+
+    # Zeroed array for the named piece of engine state, overridden to place
+    #       the state somewhere other than private memory (see parallel.TiledEngine)
+    def NewArray(self, name, shape, dtype=float):
+        return np.zeros(shape, dtype)
+
+    def SetBrightnessFn(self, bFn):
+        stencil = Stencil(bFn, self.grid, self.psr)
+        if StencilReach(stencil) > self.psr:
+            raise ValueError("%s needs PSR >= %d" % (bFn, StencilReach(stencil)))
+        self.bFn = bFn
+        self.stencil = stencil
+        self.convolver = Convolver(stencil, self.psr, self.brightnessMode)
+
+    def SetBrightnessMode(self, mode):
+        self.brightnessMode = mode
+        self.SetBrightnessFn(self.bFn)
+
+    # State is cleared in place so outside references to the arrays stay valid
+    def PowerCycle(self):
+        self.state.fill(0)
+        self.b_ext.fill(0)
+
+    def ResetActiveNodes(self):
+        self.active_nodes[...] = ActiveNodes(self.grid, self.w, self.h)
+
+    def SetNode(self, x, y, on):
+        self.active_nodes[x, y] = on
+
+    def ToggleNode(self, x, y):
+        self.active_nodes[x, y] ^= True
+
+    # Toggle every node under the tool of radius r centered on node (x, y)
+    def ToggleNodes(self, x, y, r):
+        region, mask = ClippedDisk(self.grid, r, x, y, self.w, self.h)
+        if region is not None:
+            self.active_nodes[region] ^= mask
+
+    # Shine the flash light tool of radius r centered on node (x, y)
+    #       brightness 0 takes it off again
+    def FlashLight(self, x, y, r, brightness):
+        region, mask = ClippedDisk(self.grid, r, x, y, self.w, self.h)
+        if region is not None:
+            self.b_ext[(Ellipsis,) + region][..., mask] = brightness
+
+    def ClearFlashLight(self):
+        self.b_ext.fill(0)
+
+    # Positions and LED currents of the nodes a renderer should draw
+    def DrawnNodes(self):
+        xs, ys = self.interior
+        x_pos, y_pos = np.mgrid[xs, ys]
+        return x_pos.ravel(), y_pos.ravel(), self.iD[xs, ys].ravel()
+
+    # Light sensed from neighboring LEDs over the region (xs, ys), from the
+    #       engine's own iD unless another LED current field is given
+    def BrightnessSum(self, xs, ys, iD=None):
+        return self.convolver.Sum(self.iD if iD is None else iD, xs, ys)
+
+    # New b, vg, rqi and vd from the light sensed and the nodes' own state and
+    #       inputs, zero at inactive nodes
+    def CircuitStep(self, light, b_ext, vg, vd, iD, active, pSensVariation):
+        b = light
+        b += b_ext
+        light = b * self.pSensitivity
+        if self.useVariation:
+            light *= pSensVariation
+
+        vg = GateVoltage(vg, light, self.pVRefLow, self.pVRefHigh, self.vgStepScale)
+        rqi = InverseResistance(vg)
+        vd = DrainVoltage(vd, rqi, iD, self.vdStepScale)
+        return np.where(active, b, 0), np.where(active, vg, 0), np.where(active, rqi, 0), np.where(active, vd, 0)
+
+    # New iD from the drain voltage, zero at inactive nodes
+    def CurrentStep(self, vd, active, idVariation):
+        iD = IdAtVd(vd)
+        if self.useVariation:
+            iD *= idVariation
+        return np.where(active, iD, 0)
+
+    # Brightness, gate, FET and drain update over the region (xs, ys)
+    #       reads iD only, so every region must be updated before any UpdateCurrent
+    def UpdateCircuit(self, xs, ys):
+        region = (Ellipsis, xs, ys)
+        with self.timer.Phase(BRIGHTNESS):
+            light = self.BrightnessSum(xs, ys)
+        with self.timer.Phase(CIRCUIT):
+            (self.b[region], self.vg[region],
+             self.rqi[region], self.vd[region]) = self.CircuitStep(light, self.b_ext[region],
+                                                                   self.vg[region], self.vd[region], self.iD[region],
+                                                                   self.active_nodes[xs, ys], self.pSensVariation[xs, ys])
+
+    # LED current update over the region (xs, ys)
+    def UpdateCurrent(self, xs, ys):
+        with self.timer.Phase(CURRENT):
+            self.iD[..., xs, ys] = self.CurrentStep(self.vd[..., xs, ys], self.active_nodes[xs, ys],
+                                                    self.idVariation[xs, ys])
+
+    # Returns the Euler steps' worth of time advanced when an integrator takes
+    #       several at once, None for a plain step
+    def Step(self):
+        if self.integrator is not None:
+            return self.integrator.Advance(self)
+        xs, ys = self.interior
+        self.UpdateCircuit(xs, ys)
+        self.UpdateCurrent(xs, ys)
+
+
+# Engine over an arbitrary topology.Topology, an irregular or measured board
+#       laid out as an n x 1 board with no border, every node active, and the
+#       brightness sum one product of the sensing graph with iD
+#       the tools reach every node within r dot spacings of node (x, 0)
+class GraphEngine(ArrayEngine):
+
+    def __init__(self, topology, seed=None):
+        self.topology = topology
+        ArrayEngine.__init__(self, topology.n, 1, None, 0, None, seed)
+
+    def SetBrightnessFn(self, bFn):
+        self.bFn = bFn
+        self.stencil = None
+        self.convolver = None
+
+    def SetBrightnessMode(self, mode):
+        pass
+
+    def ResetActiveNodes(self):
+        self.active_nodes.fill(True)
+
+    def _Disk(self, x, r):
+        px, py = self.topology.positions[x]
+        return self.topology.Within(px, py, r)
+
+    def ToggleNodes(self, x, y, r):
+        self.active_nodes[self._Disk(x, r), 0] ^= True
+
+    def FlashLight(self, x, y, r, brightness):
+        self.b_ext[..., self._Disk(x, r), 0] = brightness
+
+    def DrawnNodes(self):
+        return np.arange(self.w), np.zeros(self.w, dtype=np.intp), self.iD[:, 0].copy()
+
+    def BrightnessSum(self, xs, ys, iD=None):
+        light = self.topology.Sense((self.iD if iD is None else iD)[..., 0])
+        return light[..., xs, None]
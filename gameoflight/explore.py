@@ -0,0 +1,184 @@
+
+#                                                       ABOUT
+
+# Parallel settings exploration
+#       runs every combination of the given settings as its own single engine
+#       run, spread over a process pool, and ranks them by their online metrics
+
+# Each run's summary and final snapshot go into a cache.ResultCache keyed by
+#       the full configuration and the code version, so re-running a sweep, or
+#       a wider one, only computes the points that aren't cached yet
+
+# python -m gameoflight.explore --grid hex --bfn B_3 B_6 --sensitivity 0.06:0.12:0.01 --seed 1 2 3 --rank flipRate
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+
+from .cache import CACHE_DIR, CACHE_MAX_BYTES, ConfigKey, ResultCache
+from .circuit import VG_STEP_SCALE, VD_STEP_SCALE, P_SENSITIVITY, P_VREF_LOW, P_VREF_HIGH
+from .engine import ArrayEngine, TUNABLES
+from .grid import HEX, SQUARE, B_3, B_FNS
+from .headless import HeadlessRunner
+from .metrics import LIT_CURRENT, METRICS, OnlineMetrics, MetricColumn, RankRows
+from .sweep import ParseRange
+
+
+#                                                       CONSTANTS
+
+GRIDS = {'hex': HEX, 'square': SQUARE}
+
+# Axes a configuration is made of, with their defaults
+EXPLORE_DEFAULTS = (('grid', 'hex'),
+                    ('bFn', B_3),
+                    ('psr', 1),
+                    ('pSensitivity', P_SENSITIVITY),
+                    ('pVRefLow', P_VREF_LOW),
+                    ('pVRefHigh', P_VREF_HIGH),
+                    ('vgStepScale', VG_STEP_SCALE),
+                    ('vdStepScale', VD_STEP_SCALE),
+                    ('useVariation', False),
+                    ('seed', 1))          # only changes the run with useVariation
+
+NO_VARIATION_SEED = 0       # seed of every configuration without variation, so they share one key
+
+# Settings shared by every run, also part of each configuration's key
+RUN_DEFAULTS = (('w', 41), ('h', 41), ('steps', 2000), ('flashSteps', 100))
+
+
+# Every distinct combination of the given axis values as configuration dicts
+#       the seed only draws the variation fields, so without variation it is
+#       set to NO_VARIATION_SEED and seeds that would run the same are merged
+def Configs(run=None, **axes):
+    names = [name for name, default in EXPLORE_DEFAULTS]
+    for name in axes:
+        if name not in names:
+            raise ValueError("%s can't be explored, pick from %s" % (name, ', '.join(names)))
+    values = [axes.get(name, [default]) for name, default in EXPLORE_DEFAULTS]
+    run = dict(RUN_DEFAULTS, **(run or {}))
+    configs, keys = [], set()
+    for combination in itertools.product(*values):
+        config = dict(run, **dict(zip(names, combination)))
+        if not config['useVariation']:
+            config['seed'] = NO_VARIATION_SEED
+        key = ConfigKey(config)
+        if key not in keys:
+            keys.add(key)
+            configs.append(config)
+    return configs
+
+
+# Run one configuration and store it in the cache at cacheDir, runs in a pool worker
+def RunConfig(config, cacheDir=CACHE_DIR, maxBytes=CACHE_MAX_BYTES):
+    key = ConfigKey(config)
+    start = time.time()
+    try:
+        engine = ArrayEngine(config['w'], config['h'], GRIDS[config['grid']], config['psr'], config['bFn'],
+                             config['seed'])
+    except ValueError as error:
+        summary = dict(config, error=str(error))
+        ResultCache(cacheDir, maxBytes).Put(key, summary)
+        return key, summary
+    for name in TUNABLES:
+        setattr(engine, name, config[name])
+    metrics = OnlineMetrics()
+    runner = HeadlessRunner(engine, metrics=metrics)
+    runner.Run(config['steps'], flashSteps=config['flashSteps'])
+
+    active = engine.active_nodes
+    summary = dict(config, meanCurrent=float(engine.iD[active].mean()),
+                   litFraction=float((engine.iD[active] > LIT_CURRENT).mean()),
+                   elapsed=time.time() - start)
+    summary.update(metrics.Summary()[0])
+    ResultCache(cacheDir, maxBytes).Put(key, summary, engine, runner.steps)
+    return key, summary
+
+
+# Summaries of every configuration in order, cached ones read back and the rest
+#       run over jobs processes, also returns how many had to be run
+def Explore(configs, jobs=None, cache=None):
+    cache = cache or ResultCache()
+    keys = [ConfigKey(config) for config in configs]
+    results = dict((key, cache.Get(key)) for key in keys)
+    missing = dict((key, config) for key, config in zip(keys, configs) if results[key] is None)
+
+    if jobs == 1 or len(missing) <= 1:
+        for config in missing.values():
+            key, summary = RunConfig(config, cache.directory, cache.maxBytes)
+            results[key] = summary
+    elif missing:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            futures = [pool.submit(RunConfig, config, cache.directory, cache.maxBytes) for config in missing.values()]
+            for future in concurrent.futures.as_completed(futures):
+                key, summary = future.result()
+                results[key] = summary
+    cache.Evict()
+    return [results[key] for key in keys], len(missing)
+
+
+#                                                       Command line
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='gameoflight.explore',
+                                     description='Explore Game of Light settings over a process pool with a result cache')
+    parser.add_argument('--grid', nargs='+', choices=sorted(GRIDS), default=['hex'])
+    parser.add_argument('--bfn', nargs='+', choices=B_FNS, default=[B_3])
+    parser.add_argument('--psr', nargs='+', type=int, default=[1])
+    parser.add_argument('--sensitivity', type=ParseRange, default=[P_SENSITIVITY])
+    parser.add_argument('--vref-low', type=ParseRange, default=[P_VREF_LOW])
+    parser.add_argument('--vref-high', type=ParseRange, default=[P_VREF_HIGH])
+    parser.add_argument('--vg-step', type=ParseRange, default=[VG_STEP_SCALE])
+    parser.add_argument('--vd-step', type=ParseRange, default=[VD_STEP_SCALE])
+    parser.add_argument('--variation', nargs='+', choices=('off', 'on'), default=['off'],
+                        help='per-device variation, drawn from --seed when on')
+    parser.add_argument('--seed', nargs='+', type=int, default=[1])
+    parser.add_argument('--width', type=int, default=41)
+    parser.add_argument('--height', type=int, default=41)
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--flash-steps', type=int, default=100)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache', default=CACHE_DIR, help='result cache directory')
+    parser.add_argument('--cache-mb', type=float, default=CACHE_MAX_BYTES / float(1 << 20),
+                        help='cache size past which least recently used results are evicted')
+    parser.add_argument('--rank', choices=METRICS, default=None, help='sort by a metric, highest first')
+    parser.add_argument('--json', default=None, help='file to write every summary to')
+    args = parser.parse_args(argv)
+
+    configs = Configs({'w': args.width, 'h': args.height, 'steps': args.steps, 'flashSteps': args.flash_steps},
+                      grid=args.grid, bFn=args.bfn, psr=args.psr, pSensitivity=args.sensitivity,
+                      pVRefLow=args.vref_low, pVRefHigh=args.vref_high,
+                      vgStepScale=args.vg_step, vdStepScale=args.vd_step,
+                      useVariation=[v == 'on' for v in args.variation], seed=args.seed)
+    cache = ResultCache(args.cache, int(args.cache_mb * (1 << 20)))
+    start = time.time()
+    results, computed = Explore(configs, args.jobs, cache)
+    print("%d configurations, %d computed, %d from %s in %.1f s" %
+          (len(configs), computed, len(configs) - computed, cache.directory, time.time() - start))
+
+    rows = [row for row in results if 'error' not in row]
+    for row in results:
+        if 'error' in row:
+            print("skipped %s %s PSR %d: %s" % (row['grid'], row['bFn'], row['psr'], row['error']))
+    if args.rank:
+        rows = RankRows(rows, args.rank)
+    print("%-6s %-8s %3s %11s %8s %8s %9s %5s" % ('grid', 'bFn', 'PSR', 'sensitivity', 'vRefLow', 'vRefHigh',
+                                                 'variation', 'seed') +
+          ''.join(" %15s" % name for name in METRICS))
+    for row in rows:
+        print("%-6s %-8s %3d %11.4f %8.3f %8.3f %9s %5s" % (row['grid'], row['bFn'], row['psr'], row['pSensitivity'],
+                                                           row['pVRefLow'], row['pVRefHigh'],
+                                                           'on' if row['useVariation'] else 'off',
+                                                           str(row['seed']) if row['useVariation'] else '-') +
+              ''.join(MetricColumn(row.get(name)) for name in METRICS))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
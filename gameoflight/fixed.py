@@ -0,0 +1,331 @@
+
+#                                                       ABOUT
+
+# Fixed-point engine
+#       keeps the board the way a microcontroller on the real board would:
+#       integer codes in int16 / int32 arrays, the FET inverse resistance and
+#       the LED current curve read from lookup tables, and only integer adds,
+#       multiplies and shifts while stepping
+
+# A field's value is its code / 2^FRAC, see the formats below. engine.b, vg,
+#       vd and iD hold codes and engine.Dense(name) gives the values, like
+#       PackedEngine.Dense, so recordings and cycle detection see real currents
+#       rqi isn't kept, Dense('rqi') reads it from the table at the gate codes
+# 16 bytes per node against ArrayEngine's 65. Stepping is integer work the
+#       float engine does in fewer numpy calls, so it only pulls ahead on large
+#       boards (~33 against ~14 steps/s at 1001 x 1001, but ~6.3k against
+#       ~7.9k at 41 x 41)
+# Snapshots don't support this engine
+# The float engines are the model, CompareWithFloat() reports how far one
+#       fixed step strays from a float step from the same state, and how far
+#       the board's statistics drift when both run free. A node whose drain
+#       sits right at V_Q_TH can still differ by ~0.3 mA in one step, where the
+#       float LED current curve itself jumps
+
+# python -m gameoflight.fixed --steps 2000
+
+import argparse
+import sys
+
+import numpy as np
+
+from .circuit import (VDD, VN, VP, VG_STEP_SCALE, VD_STEP_SCALE,
+                      P_SENSITIVITY, P_VREF_LOW, P_VREF_HIGH)
+from .engine import ArrayEngine, NewSeed, ClippedDisk, InverseResistance, IdAtVd
+from .grid import HEX, SQUARE, B_3, B_FNS, ActiveNodes, Stencil, StencilReach
+from .metrics import LIT_CURRENT
+from .timing import NULL_TIMER, BRIGHTNESS, CIRCUIT, CURRENT
+
+
+#                                                       CONSTANTS
+
+# Formats, value = code / 2^FRAC
+B_FRAC = 5          # int16 brightness, up to 1024 in 1/32 steps
+VG_FRAC = 11        # int16 gate voltage, +-16 V in 0.5 mV steps
+RQI_FRAC = 8        # int16 FET inverse resistance, up to 128 / kOhm
+VD_FRAC = 16        # int32 drain voltage, fine enough that the slow drain relaxation doesn't stall
+ID_FRAC = 9         # int16 LED current, up to 64 mA in 2 uA steps
+VAR_FRAC = 14       # int16 per-device variation factors
+
+WEIGHT_FRAC = 10    # brightness function weights
+SENS_FRAC = 14      # phototransistor sensitivity
+GATE_STEP_FRAC = 14     # gate step scale, small enough to keep the gate update in int32
+DRAIN_STEP_FRAC = 24    # drain step scale, it is tiny and the update is in int64 anyway
+
+LUT_VD_FRAC = 12    # drain voltage resolution of the LED current table
+
+FIELD_FRACS = (('b', B_FRAC), ('vg', VG_FRAC), ('rqi', RQI_FRAC), ('vd', VD_FRAC), ('iD', ID_FRAC),
+               ('pSensVariation', VAR_FRAC), ('idVariation', VAR_FRAC))
+
+FIELD_DTYPES = (('b', np.int16), ('vg', np.int16), ('vd', np.int32), ('iD', np.int16))
+
+COMPARED_FIELDS = ('b', 'vg', 'rqi', 'vd', 'iD')
+
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+def Quantize(value, frac, dtype=np.int64):
+    return np.asarray(np.rint(np.asarray(value, dtype=float) * (1 << frac)), dtype=dtype)
+
+
+# x / 2^s rounded to nearest, in place
+def _ShiftInPlace(x, s):
+    x += 1 << (s - 1)
+    x >>= s
+
+
+# RQi for every gate code from VN up to VP, zero at both ends so gate codes
+#       outside the FET window can be clipped onto them
+def InverseResistanceTable():
+    lo, hi = int(np.floor(VN * (1 << VG_FRAC))), int(np.ceil(VP * (1 << VG_FRAC)))
+    vg = np.arange(lo, hi + 1) / float(1 << VG_FRAC)
+    table = Quantize(InverseResistance(vg), RQI_FRAC, np.int16)
+    table[0] = table[-1] = 0
+    return lo, table
+
+
+# LED current for every drain code from 0 to VDD at LUT_VD_FRAC
+def CurrentTable():
+    vd = np.arange(int(VDD * (1 << LUT_VD_FRAC)) + 1) / float(1 << LUT_VD_FRAC)
+    return Quantize(np.maximum(IdAtVd(vd), 0), ID_FRAC, np.int16)
+
+
+#                                                       Engine
+
+class FixedEngine(object):
+
+    timer = NULL_TIMER      # per phase step timing, see timing.PhaseTimer
+
+    def __init__(self, w=41, h=41, grid=HEX, psr=1, bFn=B_3, seed=None):
+        self.w = w
+        self.h = h
+        self.grid = grid
+        self.psr = psr
+        self.seed = seed = NewSeed() if seed is None else seed
+
+        # tunables stay floats, they are turned into integer coefficients each step
+        self.vgStepScale = VG_STEP_SCALE
+        self.vdStepScale = VD_STEP_SCALE
+        self.pSensitivity = P_SENSITIVITY
+        self.pVRefLow = P_VREF_LOW
+        self.pVRefHigh = P_VREF_HIGH
+        self.useVariation = False
+
+        self.interior = (slice(psr, w - psr), slice(psr, h - psr))
+        for name, dtype in FIELD_DTYPES:
+            setattr(self, name, np.zeros((w, h), dtype))
+        self.b_ext = np.zeros((w, h), np.uint8)
+        self.active_nodes = np.zeros((w, h), bool)
+
+        # same draws as ArrayEngine, so both start from the same devices
+        rng = np.random.RandomState(seed)
+        self.pSensVariation = Quantize(rng.random_sample((w, h)) * 0.2 + 0.9, VAR_FRAC, np.int16)
+        self.idVariation = Quantize(rng.random_sample((w, h)) * 0.2 + 0.9, VAR_FRAC, np.int16)
+
+        self.rqiBase, self.rqiTable = InverseResistanceTable()
+        self.currentTable = CurrentTable()
+
+        self.SetBrightnessFn(bFn)
+        self.ResetActiveNodes()
+
+    def SetBrightnessFn(self, bFn):
+        stencil = Stencil(bFn, self.grid, self.psr)
+        if StencilReach(stencil) > self.psr:
+            raise ValueError("%s needs PSR >= %d" % (bFn, StencilReach(stencil)))
+        self.bFn = bFn
+        self.stencil = stencil
+        self.weights = [(int(Quantize(weight, WEIGHT_FRAC)), offsets) for weight, offsets in stencil]
+
+    # Values of a field as floats, from its codes
+    def Dense(self, name):
+        if name == 'rqi':
+            return self.InverseResistance(self.vg) / float(1 << RQI_FRAC)
+        return getattr(self, name) / float(1 << dict(FIELD_FRACS)[name])
+
+    # RQi codes of gate codes vg, from the table
+    def InverseResistance(self, vg):
+        return self.rqiTable.take(vg.astype(np.int32, copy=False) - self.rqiBase, mode='clip')
+
+    def PowerCycle(self):
+        for name, dtype in FIELD_DTYPES:
+            getattr(self, name).fill(0)
+        self.b_ext.fill(0)
+
+    def ResetActiveNodes(self):
+        self.active_nodes[...] = ActiveNodes(self.grid, self.w, self.h)
+
+    def SetNode(self, x, y, on):
+        self.active_nodes[x, y] = on
+
+    def ToggleNode(self, x, y):
+        self.active_nodes[x, y] ^= True
+
+    def ToggleNodes(self, x, y, r):
+        region, mask = ClippedDisk(self.grid, r, x, y, self.w, self.h)
+        if region is not None:
+            self.active_nodes[region] ^= mask
+
+    # b_ext is a byte per node, brightness is clipped to 0..255
+    def FlashLight(self, x, y, r, brightness):
+        region, mask = ClippedDisk(self.grid, r, x, y, self.w, self.h)
+        if region is not None:
+            self.b_ext[region][mask] = min(max(int(brightness), 0), 255)
+
+    def ClearFlashLight(self):
+        self.b_ext.fill(0)
+
+    def DrawnNodes(self):
+        xs, ys = self.interior
+        x_pos, y_pos = np.mgrid[xs, ys]
+        return x_pos.ravel(), y_pos.ravel(), self.Dense('iD')[xs, ys].ravel()
+
+    # Weighted neighbor sum of iD codes over the interior at ID_FRAC + WEIGHT_FRAC
+    def BrightnessSum(self):
+        xs, ys = self.interior
+        light = np.zeros((xs.stop - xs.start, ys.stop - ys.start), np.int32)
+        for weight, offsets in self.weights:
+            group = np.zeros_like(light)
+            for dx, dy in offsets:
+                group += self.iD[xs.start + dx:xs.stop + dx, ys.start + dy:ys.stop + dy]
+            group *= weight
+            light += group
+        return light
+
+    # int32 throughout but for the drain update, which needs int64 products
+    def Step(self):
+        xs, ys = self.interior
+        active = self.active_nodes[xs, ys]
+
+        with self.timer.Phase(BRIGHTNESS):
+            b = self.BrightnessSum()
+
+        with self.timer.Phase(CIRCUIT):
+            _ShiftInPlace(b, ID_FRAC + WEIGHT_FRAC - B_FRAC)
+            b += self.b_ext[xs, ys].astype(np.int32) << B_FRAC
+            np.minimum(b, INT16_MAX, out=b)
+
+            # gate: vg += (b * sensitivity + pVRefLow - vg) * vgStepScale, capped at pVRefHigh
+            target = b * int(Quantize(self.pSensitivity, SENS_FRAC))
+            if self.useVariation:
+                target = b * self.pSensVariation[xs, ys]
+                _ShiftInPlace(target, VAR_FRAC)
+                target *= int(Quantize(self.pSensitivity, SENS_FRAC))
+            _ShiftInPlace(target, B_FRAC + SENS_FRAC - VG_FRAC)
+            target += int(Quantize(self.pVRefLow, VG_FRAC))
+            np.clip(target, INT16_MIN, INT16_MAX, out=target)
+            vg = self.vg[xs, ys].astype(np.int32)
+            target -= vg
+            target *= int(Quantize(self.vgStepScale, GATE_STEP_FRAC))
+            _ShiftInPlace(target, GATE_STEP_FRAC)
+            vg += target
+            np.minimum(vg, int(Quantize(self.pVRefHigh, VG_FRAC)), out=vg)
+
+            rqi = self.InverseResistance(vg)
+
+            # drain: vd += ((VDD - vd) * rqi - iD) * vdStepScale, capped at VDD
+            vd = self.vd[xs, ys].astype(np.int64)
+            rate = int(Quantize(VDD, VD_FRAC)) - vd
+            rate *= rqi
+            rate -= self.iD[xs, ys].astype(np.int64) << (VD_FRAC + RQI_FRAC - ID_FRAC)
+            rate *= int(Quantize(self.vdStepScale, DRAIN_STEP_FRAC))
+            _ShiftInPlace(rate, RQI_FRAC + DRAIN_STEP_FRAC)
+            vd += rate
+            np.minimum(vd, int(Quantize(VDD, VD_FRAC)), out=vd)
+
+            for name, field in (('b', b), ('vg', vg), ('vd', vd)):
+                np.multiply(field, active, out=getattr(self, name)[xs, ys], casting='unsafe')
+
+        with self.timer.Phase(CURRENT):
+            index = self.vd[xs, ys] + (1 << (VD_FRAC - LUT_VD_FRAC - 1))
+            index >>= VD_FRAC - LUT_VD_FRAC
+            iD = self.currentTable.take(index, mode='clip')
+            if self.useVariation:
+                iD = iD.astype(np.int32)
+                iD *= self.idVariation[xs, ys]
+                _ShiftInPlace(iD, VAR_FRAC)
+            np.multiply(iD, active, out=self.iD[xs, ys], casting='unsafe')
+
+
+# Bytes of board arrays an engine keeps per node, lookup tables left out
+def BytesPerNode(engine):
+    arrays = [a for a in vars(engine).values()
+              if isinstance(a, np.ndarray) and a.base is None and a.shape[-2:] == (engine.w, engine.h)]
+    return sum(a.nbytes for a in arrays) / float(engine.w * engine.h)
+
+
+#                                                       Divergence
+
+# Run a fixed engine side by side with two float engines set up the same way
+#       one is re-synced to the fixed state before every step, giving the
+#       largest single step deviation of each field, the other runs free, and
+#       the mean LED current and lit fraction of both are compared at the end
+#       the flash light is held on the grid center for flashSteps, then removed
+def CompareWithFloat(engine, steps=2000, flashSteps=100, r=2, brightness=140):
+    synced = ArrayEngine(engine.w, engine.h, engine.grid, engine.psr, engine.bFn, engine.seed)
+    free = ArrayEngine(engine.w, engine.h, engine.grid, engine.psr, engine.bFn, engine.seed)
+    for e in (synced, free):
+        for name in ('vgStepScale', 'vdStepScale', 'pSensitivity', 'pVRefLow', 'pVRefHigh', 'useVariation'):
+            setattr(e, name, getattr(engine, name))
+        e.pSensVariation[...] = engine.Dense('pSensVariation')
+        e.idVariation[...] = engine.Dense('idVariation')
+        e.active_nodes[...] = engine.active_nodes
+        for name in COMPARED_FIELDS:
+            getattr(e, name)[...] = engine.Dense(name)
+
+    for e in (engine, synced, free):
+        e.FlashLight(engine.w // 2, engine.h // 2, r, brightness)
+    deviation = dict((name, 0.0) for name in COMPARED_FIELDS)
+    for step in range(steps):
+        if step == flashSteps:
+            for e in (engine, synced, free):
+                e.ClearFlashLight()
+        for name in ('vg', 'vd', 'iD'):
+            getattr(synced, name)[...] = engine.Dense(name)
+        for e in (engine, synced, free):
+            e.Step()
+        for name in COMPARED_FIELDS:
+            deviation[name] = max(deviation[name], float(np.max(np.abs(getattr(synced, name) - engine.Dense(name)))))
+
+    active = engine.active_nodes
+    fixedCurrent, floatCurrent = engine.Dense('iD')[active], free.iD[active]
+    return {'steps': steps,
+            'stepDeviation': deviation,
+            'meanCurrent': (float(fixedCurrent.mean()), float(floatCurrent.mean())),
+            'litFraction': (float((fixedCurrent > LIT_CURRENT).mean()), float((floatCurrent > LIT_CURRENT).mean())),
+            'bytesPerNode': (BytesPerNode(engine), BytesPerNode(free))}
+
+
+def DivergenceLines(result):
+    lines = ["largest single step deviation from the float engine over %d steps:" % result['steps']]
+    lines += ["  %-4s %.3g" % (name, result['stepDeviation'][name]) for name in COMPARED_FIELDS]
+    lines.append("%-14s %10s %10s" % ('', 'fixed', 'float'))
+    lines.append("%-14s %10.4f %10.4f" % (('meanCurrent',) + result['meanCurrent']))
+    lines.append("%-14s %10.3f %10.3f" % (('litFraction',) + result['litFraction']))
+    lines.append("%-14s %10.1f %10.1f" % (('bytes / node',) + result['bytesPerNode']))
+    return lines
+
+
+#                                                       Command line
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='gameoflight.fixed',
+                                     description='Compare the fixed-point engine with the float engine')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--grid', choices=('hex', 'square'), default='hex')
+    parser.add_argument('--width', type=int, default=41)
+    parser.add_argument('--height', type=int, default=41)
+    parser.add_argument('--psr', type=int, default=1)
+    parser.add_argument('--bfn', choices=B_FNS, default=B_3)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--variation', action='store_true', help='turn on the per-device variation')
+    parser.add_argument('--flash-steps', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    engine = FixedEngine(args.width, args.height, HEX if args.grid == 'hex' else SQUARE, args.psr, args.bfn, args.seed)
+    engine.useVariation = args.variation
+    print('\n'.join(DivergenceLines(CompareWithFloat(engine, args.steps, args.flash_steps))))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
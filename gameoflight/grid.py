@@ -0,0 +1,102 @@
+
+#                                                       ABOUT
+
+# Grid geometry for the Game of Light
+#       grid types, distance lookup table, initially active nodes and the
+#       neighbor offsets ("stencils") summed by each brightness function
+
+# Everything here is plain Python so it can be shared by the per-node
+#       reference engine and the array engines
+
+
+#                                                       CONSTANTS
+
+HEX = 0             # Hexagonal grid type
+SQUARE = 1          # Square grid type
+
+# Brightness functions - one is picked per engine
+B_3 = 'B_3'             # Three LEDs at 120deg, hex grid
+B_6 = 'B_6'             # Six adjacent LEDs, hex grid
+B_4 = 'B_4'             # Four adjacent LEDs, square grid
+B_HEX = 'B_hex'         # Generalized hex sum weighted by d for any PSR
+B_SQUARE = 'B_square'   # Generalized square sum weighted by d for any PSR
+
+B_FNS = (B_3, B_6, B_4, B_HEX, B_SQUARE)
+
+
+#                                                       PRE-CALCS
+
+# distance (d = 1/(x^2 + y^2)) lookup table for max PSR distance in x or y from node
+def DistanceTable(grid, psr):
+    if grid == HEX:
+        return [[(0 if (i == 0 and j == 0) else 1.0/((i + 1 - j/2.0)**2 + (3.0/4)*(j)**2)) for j in range(psr + 1)] for i in range(psr + 1)]
+    return [[(0 if (i == 0 and j == 0) else 1.0/(i**2 + j**2)) for j in range(psr + 1)] for i in range(psr + 1)]
+
+
+# initially active nodes, indexed [x][y] with 1 for active
+def ActiveNodes(grid, w, h):
+    if grid == HEX:
+        # active nodes as hexagon
+        return [[(1 if (i - j < (w - 1)/ 2.0 and j - i < (w - 1)/ 2.0) else 0) for j in range(h)] for i in range(w)]
+    return [[1 for j in range(h)] for i in range(w)]
+
+
+# Neighbor offsets summed by a brightness function
+#       returns [(weight, [(dx, dy), ...]), ...] in the same order the per-node
+#       functions add them up, so array sums can reproduce them bit for bit
+def Stencil(bFn, grid, psr):
+    if bFn == B_3:
+        return [(1.0, [(1, 0), (0, 1), (-1, -1)])]
+    if bFn == B_6:
+        return [(1.0, [(1, 0), (1, 1), (0, 1), (-1, 0), (-1, -1), (0, -1)])]
+    if bFn == B_4:
+        return [(1.0, [(1, 0), (0, 1), (0, -1), (-1, 0)])]
+
+    d = DistanceTable(grid, psr)
+    groups = []
+    for i in range(1, psr + 1):
+        for j in range(psr + 1):
+            if bFn == B_HEX:
+                groups.append((d[i][j], [(i, j), (-j, i - j), (j - i, -i)]))
+            elif bFn == B_SQUARE:
+                groups.append((d[i][j], [(i, j), (-j, i), (-i, -j), (j, -i)]))
+            else:
+                raise ValueError("unknown brightness function: %r" % (bFn,))
+    return groups
+
+
+# Max distance in x or y reached by a stencil
+def StencilReach(stencil):
+    return max(max(abs(dx), abs(dy)) for weight, offsets in stencil for dx, dy in offsets)
+
+
+# Offsets lit by the flash light / toggle tool of radius r
+def DiskOffsets(grid, r):
+    if grid == HEX:
+        return [(i, j) for i in range(-r, r + 1) for j in range(-r, r + 1) if i - j <= r and j - i <= r]
+    return [(i, j) for i in range(-r, r + 1) for j in range(-r, r + 1)]
+
+
+#                                                       Drawing geometry
+
+# Window size in px for dot spacing ds
+def WindowSize(grid, w, h, ds):
+    if grid == HEX:
+        return int((w + h/2.0) * ds), int(3.0**(0.5)/2 * (h + 1) * ds)
+    return int(w * ds + 250), int(h * ds)
+
+
+# Node positions in dot spacings, one (x, y) per node in [x][y] order
+#       hex rows are shifted half a spacing per row, like the window layout
+def LatticePositions(grid, w, h):
+    if grid == HEX:
+        return [(i - j/2.0 + h/2.0, (3**0.5)/2*(j+1)) for i in range(w) for j in range(h)]
+    return [(i, j) for i in range(w) for j in range(h)]
+
+
+# Dot positions in px, dot_x_pos indexed [x][y] and dot_y_pos indexed [y]
+def DotPositions(grid, w, h, ds):
+    positions = LatticePositions(grid, w, h)
+    dot_x_pos = [[int(positions[i*h + j][0]*ds) for j in range(h)] for i in range(w)]
+    dot_y_pos = [int(positions[j][1]*ds) for j in range(h)]
+    return dot_x_pos, dot_y_pos
@@ -0,0 +1,68 @@
+
+#                                                       ABOUT
+
+# Headless runner
+#       advances an engine as fast as it will go with no display attached and
+#       only hands frames to a renderer every frameEvery steps or on request
+
+import time
+
+
+class HeadlessRunner(object):
+
+    # onFrame(engine, step) is called whenever a frame is due, frameEvery = 0
+    #       means frames are only produced through RequestFrame()
+    # detector (cycles.CycleDetector) ends the run as soon as the board has
+    #       settled or started repeating, it only watches once the flash light is off
+    # metrics (metrics.OnlineMetrics) is fed every step once the flash light is off
+    def __init__(self, engine, onFrame=None, frameEvery=0, detector=None, metrics=None):
+        self.engine = engine
+        self.onFrame = onFrame
+        self.frameEvery = frameEvery
+        self.detector = detector
+        self.metrics = metrics
+        self.frameRequested = False
+        self.steps = 0
+        self.elapsed = 0.0
+
+    # Ask for the next completed step to be handed to onFrame
+    #       safe to call from another thread
+    def RequestFrame(self):
+        self.frameRequested = True
+
+    # Advance the engine by steps, flash light held on the grid center for
+    #       the first flashSteps of them to seed a pattern
+    # An engine with an integrator (integrate.py) takes several Euler steps'
+    #       worth of time per Step(), steps and flashSteps count Euler steps and
+    #       no Step() runs past the end of the flash light or of the run
+    def Run(self, steps, flashSteps=0, flashRadius=2, flashBrightness=140):
+        engine = self.engine
+        integrator = getattr(engine, 'integrator', None)
+        start = time.time()
+        done = 0
+        while done < steps:
+            if done == 0 and flashSteps:
+                engine.FlashLight(engine.w // 2, engine.h // 2, flashRadius, flashBrightness)
+            if done == flashSteps and flashSteps:
+                engine.ClearFlashLight()
+            if integrator is not None:
+                integrator.limit = (flashSteps if done < flashSteps else steps) - done
+            advanced = engine.Step() or 1
+            self.steps += advanced
+            if self.onFrame is not None and (self.frameRequested or
+                                             (self.frameEvery and
+                                              self.steps // self.frameEvery != (self.steps - advanced) // self.frameEvery)):
+                self.frameRequested = False
+                self.onFrame(engine, self.steps)
+            if self.metrics is not None and done >= flashSteps:
+                self.metrics.Observe(engine, self.steps)
+            if self.detector is not None and done >= flashSteps and self.detector.Observe(engine, self.steps):
+                break
+            done += advanced
+        if integrator is not None:
+            integrator.limit = None
+        self.elapsed += time.time() - start
+        return self.steps
+
+    def StepRate(self):
+        return self.steps / self.elapsed if self.elapsed else 0.0
@@ -0,0 +1,363 @@
+
+#                                                       ABOUT
+
+# Stiffness-aware integrators
+#       VG and VD are forward Euler relaxations with tiny step scales, so most
+#       steps are spent creeping towards a quasi-steady state. These integrators
+#       take m Euler steps' worth of time per evaluation of the RQi / Id_at_Vd chain
+
+# Over one macro step the light each node senses is held fixed, the gate
+#       relaxes exactly as m Euler steps would, and the drain equation is
+#       linearized around the LED current (semi-implicit), which turns it into a
+#       linear relaxation that can also be taken m Euler steps at once
+# Holding the light is what costs accuracy: a lit node drives its neighbors
+#       within a step or two, so on a board with a moving pattern even m = 2
+#       ends ~0.1 V off in vd and patterns spread at the wrong speed
+# Every macro step is therefore also taken as two halves, the second sensing
+#       the light the first left, the state extrapolated from the two kept,
+#       and all of it thrown away for a plain Euler step when the two differ
+#       by more than tolerance in vg or vd. m shrinks on those and grows
+#       while the halves agree, so a live board runs plain Euler steps (at
+#       about Euler's cost, its statistics within the spread Euler's own show
+#       under a 1e-6 V nudge) and a settling or quiet one runs up to substeps
+#       per macro step, ~5 - 10x fewer evaluations at m = 32
+# Only ArrayEngine.Step() and engines that inherit it use the integrator
+
+# Attach one to an engine with engine.integrator = ExponentialIntegrator(8)
+# Step() returns the Euler steps a macro step advanced and HeadlessRunner counts
+#       those, so --steps and --flash-steps mean the same time with or without
+#       an integrator. The runner sets limit so no macro step runs past the end
+#       of the flash light or of the run
+
+# python -m gameoflight.integrate --integrator exponential --substeps 8 --steps 2000
+#       runs the integrator and plain Euler side by side, see CompareWithEuler,
+#       and exits with 1 when the integrator doesn't track Euler
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from .circuit import VDD, VN, VP, RQI_BASE, QA, QB, SLOPE, V_Q_TH
+from .engine import ArrayEngine, TUNABLES, InverseResistance, IdAtVd
+from .grid import HEX, SQUARE, B_3, B_FNS
+from .headless import HeadlessRunner
+from .metrics import LIT_CURRENT, METRICS, OnlineMetrics
+
+
+#                                                       CONSTANTS
+
+TOLERANCE = 0.01        # largest vg or vd difference [V] between a macro step and its halves
+PROBE_MIN = 8           # plain Euler steps before macro steps are tried again
+PROBE_MAX = 256         # the same after repeated failed tries
+
+TRACK_TOLERANCE = 0.05  # litMean / litFraction difference from Euler CompareWithEuler allows
+
+
+# Slope of the LED current curve, dId/dVd
+def IdSlope(v):
+    return np.where(v > V_Q_TH, 2*QA*v + QB, SLOPE)
+
+
+# Factor (1 - hk)^m taken by m Euler steps of a relaxation with rate k
+#       where Euler would overshoot (hk >= 1) the relaxation simply completes
+def RelaxFactor(hk, m):
+    return np.maximum(1 - np.asarray(hk, dtype=float), 0) ** m
+
+
+# Mean FET inverse resistance over m Euler steps of the gate relaxing from vg towards target
+#       step j puts the gate at vg(j) = target + (vg - target) u(j) with
+#       u(t) = (1 - vgStepScale)^t and uses RQi(vg(j)), so the clipped RQi
+#       parabola is integrated exactly along that path over t in [1, m] and the
+#       ends added with trapezoid weights, which gives RQi(vg(1)) for m = 1
+#       The gate can cross the whole FET window within a few steps, which
+#       sampling RQi at the end of a long step would miss altogether
+def MeanInverseResistance(vg, target, pVRefHigh, vgStepScale, m):
+    rate = -np.log1p(-np.minimum(vgStepScale, 1 - 1e-12))
+    u0 = np.exp(-rate)
+    u1 = np.exp(-m * rate)
+    d = vg - target
+    d[d == 0] = 1e-300      # a gate already at its target is in or out of the window throughout
+
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        # u over which target + d u lies inside (VN, min(VP, cap)), clipped to [u1, u0]
+        a = (VN - target) / d
+        b = (np.minimum(VP, pVRefHigh) - target) / d
+        lo = np.clip(np.minimum(a, b), u1, u0)
+        hi = np.clip(np.maximum(a, b), u1, u0)
+
+        # integral of the parabola over t while u runs down from hi to lo
+        p, s = target - VN, VP - target
+        total = p * s * np.log(hi / lo)
+        total += (s - p) * d * (hi - lo)
+        total -= 0.5 * d * d * (hi * hi - lo * lo)
+
+        # the gate only rests on a cap it can conduct at if pVRefHigh was set below VP
+        capped = np.maximum((pVRefHigh - VN) * (VP - pVRefHigh), 0)
+        if np.any(capped):
+            c = np.clip((pVRefHigh - target) / d, u1, u0)
+            lo, hi = np.where(d > 0, c, u1), np.where(d > 0, u0, c)
+            total += capped * np.log(hi / lo)
+    total *= RQI_BASE / rate
+
+    ends = InverseResistance(np.minimum(target + d * u0, pVRefHigh))
+    ends += InverseResistance(np.minimum(target + d * u1, pVRefHigh))
+    total += 0.5 * ends
+    total /= m
+    return np.maximum(total, 0, out=total)
+
+
+# State of the interior after m Euler steps' worth of time from (vg, vd, iD)
+#       iD is the whole LED current field, vg and vd are the interior only
+#       returns b, vg, rqi, vd and iD over the interior, b is the brightness
+#       summed from iD when it is already known
+def MacroStep(engine, iD, vg, vd, m, b=None):
+    xs, ys = engine.interior
+    region = (Ellipsis, xs, ys)
+    active = engine.active_nodes[xs, ys]
+
+    if b is None:
+        b = engine.BrightnessSum(xs, ys, iD)
+    b = b + engine.b_ext[region]
+    light = b * engine.pSensitivity
+    if engine.useVariation:
+        light *= engine.pSensVariation[xs, ys]
+
+    # gate: exactly where m Euler steps leave it, the sensed light held fixed
+    target = light + engine.pVRefLow
+    meanRqi = MeanInverseResistance(vg, target, engine.pVRefHigh, engine.vgStepScale, m)
+    vg = target + (vg - target) * RelaxFactor(engine.vgStepScale, m)
+    vg = np.minimum(vg, engine.pVRefHigh, out=vg)
+    rqi = InverseResistance(vg)
+
+    # drain: d vd = (VDD - vd) rqi - iD(vd) with iD(vd') ~ iD + slope (vd' - vd)
+    #       is a linear relaxation at rate k = rqi + slope, so m steps move it
+    #       by (1 - (1 - hk)^m) / k times the rate
+    current = iD[region]
+    slope = IdSlope(vd)
+    if engine.useVariation:
+        slope = slope * engine.idVariation[xs, ys]
+    k = meanRqi + slope
+    hk = engine.vdStepScale * k
+    relaxing = hk > 1e-12
+    gain = np.where(relaxing, (1 - RelaxFactor(hk, m)) / np.where(relaxing, k, 1), m * engine.vdStepScale)
+    vd = vd + gain * ((VDD - vd) * meanRqi - current)
+    vd = np.minimum(vd, VDD, out=vd)
+
+    current = IdAtVd(vd)
+    if engine.useVariation:
+        current *= engine.idVariation[xs, ys]
+    return (np.where(active, b, 0), np.where(active, vg, 0), np.where(active, rqi, 0),
+            np.where(active, vd, 0), np.where(active, current, 0))
+
+
+class ExponentialIntegrator(object):
+
+    # substeps is the most Euler steps a macro step takes, tolerance [V] the
+    #       largest difference in vg or vd between a macro step and the same
+    #       time taken in two halves that is accepted
+    def __init__(self, substeps=8, tolerance=TOLERANCE):
+        self.substeps = substeps
+        self.tolerance = tolerance
+        self.m = substeps           # Euler steps the next macro step tries
+        self.limit = None           # most Euler steps the next macro step may take
+        self.probeEvery = PROBE_MIN
+        self.plainSteps = 0         # plain Euler steps since m fell to 1 or was last tried
+        self.error = 0.0            # difference between the last macro step and its halves [V]
+        self.stepsAdvanced = 0      # Euler steps' worth of time advanced
+        self.evaluations = 0        # evaluations of the RQi / Id_at_Vd chain
+        self.rejected = 0           # macro steps thrown away for going over tolerance
+
+    # Euler steps the next macro step takes, m cut down to limit
+    def _Substeps(self):
+        if self.limit is None:
+            return self.m
+        return max(1, min(self.m, self.limit))
+
+    def _Commit(self, engine, new):
+        xs, ys = engine.interior
+        for field, value in zip((engine.b, engine.vg, engine.rqi, engine.vd, engine.iD), new):
+            field[..., xs, ys] = value
+
+    # One of the engine's own Euler steps, macro steps are tried again after probeEvery of them
+    def _EulerStep(self, engine):
+        xs, ys = engine.interior
+        engine.UpdateCircuit(xs, ys)
+        engine.UpdateCurrent(xs, ys)
+        self.stepsAdvanced += 1
+        self.evaluations += 1
+        self.plainSteps += 1
+        if self.plainSteps >= self.probeEvery:
+            self.m = min(2, self.substeps)
+            self.plainSteps = 0
+        return 1
+
+    # m Euler steps' worth of time as one macro step and as two halves, the
+    #       second half sensing the light the first one left, returns the
+    #       state extrapolated from the two (2 halves - whole, which cancels
+    #       most of the error from holding the light) and the largest
+    #       difference in vg or vd between them
+    def _DoubledStep(self, engine, m):
+        xs, ys = engine.interior
+        vg, vd = engine.vg[..., xs, ys], engine.vd[..., xs, ys]
+        b = engine.BrightnessSum(xs, ys, engine.iD)
+        whole = MacroStep(engine, engine.iD, vg, vd, m, b)
+        half = MacroStep(engine, engine.iD, vg, vd, m // 2, b)
+        iD = engine.iD.copy()
+        iD[..., xs, ys] = half[4]
+        halves = MacroStep(engine, iD, half[1], half[3], m - m // 2)
+        error = max(np.max(np.abs(halves[1] - whole[1])), np.max(np.abs(halves[3] - whole[3])))
+
+        active = engine.active_nodes[xs, ys]
+        vg = np.minimum(2 * halves[1] - whole[1], engine.pVRefHigh)
+        vd = np.minimum(2 * halves[3] - whole[3], VDD)
+        current = IdAtVd(vd)
+        if engine.useVariation:
+            current *= engine.idVariation[xs, ys]
+        new = (halves[0], np.where(active, vg, 0), np.where(active, InverseResistance(vg), 0),
+               np.where(active, vd, 0), np.where(active, current, 0))
+        return new, float(error)
+
+    # Macro steps whose halves stay within tolerance of the whole are kept and
+    #       m doubles (up to substeps) while they are under tolerance / 4, a
+    #       macro step over tolerance is thrown away for a plain Euler step and
+    #       m halves. At m = 1 macro steps are tried again after probeEvery
+    #       plain steps, which doubles (up to PROBE_MAX) each time the try fails
+    def Advance(self, engine):
+        m = self._Substeps()
+        if m == 1:
+            return self._EulerStep(engine)
+
+        new, self.error = self._DoubledStep(engine, m)
+        self.evaluations += 3
+        if self.error > self.tolerance:
+            self.rejected += 1
+            self.m = max(m // 2, 1)
+            if self.m == 1:
+                self.probeEvery = min(2 * self.probeEvery, PROBE_MAX)
+                self.plainSteps = 0
+            return self._EulerStep(engine)
+
+        self._Commit(engine, new)
+        self.stepsAdvanced += m
+        self.probeEvery = PROBE_MIN
+        if m == self.m and self.error < self.tolerance / 4:
+            self.m = min(2 * m, self.substeps)
+        return m
+
+    def StepsSaved(self):
+        return self.stepsAdvanced - self.evaluations
+
+    def Report(self):
+        return "%d Euler steps in %d evaluations, %d saved (%.1fx), %d macro steps rejected" % (
+            self.stepsAdvanced, self.evaluations, self.StepsSaved(),
+            self.stepsAdvanced / float(max(self.evaluations, 1)), self.rejected)
+
+
+class AdaptiveIntegrator(ExponentialIntegrator):
+
+    # Starts from plain Euler steps and lets m grow up to maxSubsteps, a
+    #       change of b_ext (the flash light) drops it back to plain steps
+    def __init__(self, tolerance=TOLERANCE, maxSubsteps=32):
+        ExponentialIntegrator.__init__(self, maxSubsteps, tolerance)
+        self.maxSubsteps = maxSubsteps
+        self.m = 1
+        self.seen_b_ext = None
+
+    def Advance(self, engine):
+        if self.seen_b_ext is None or not np.array_equal(self.seen_b_ext, engine.b_ext):
+            self.seen_b_ext = engine.b_ext.copy()
+            self.m = 1
+            self.plainSteps = 0
+            self.probeEvery = PROBE_MIN
+        return ExponentialIntegrator.Advance(self, engine)
+
+
+# Run engine (with its integrator) and a plain Euler copy of it from the same
+#       state through HeadlessRunner, steps Euler steps with the flash light
+#       on for the first flashSteps, and compare how the two end up
+#       a moving pattern is chaotic, so past the settling transient the
+#       metrics after the flash light are what should agree, not the fields
+#       autocorrelation is over one Step(), which for the integrator spans m steps
+def CompareWithEuler(engine, steps=2000, flashSteps=100):
+    euler = ArrayEngine(engine.w, engine.h, engine.grid, engine.psr, engine.bFn, engine.seed)
+    for name in TUNABLES:
+        setattr(euler, name, getattr(engine, name))
+    for name in ('pSensVariation', 'idVariation', 'active_nodes', 'b', 'vg', 'rqi', 'vd', 'iD'):
+        getattr(euler, name)[...] = getattr(engine, name)
+
+    result = {'steps': steps, 'summary': [], 'meanCurrent': [], 'litFraction': [], 'elapsed': [],
+              'evaluations': []}
+    for e in (engine, euler):
+        evaluations = e.integrator.evaluations if e.integrator is not None else 0
+        metrics = OnlineMetrics()
+        runner = HeadlessRunner(e, metrics=metrics)
+        start = time.time()
+        runner.Run(steps, flashSteps)
+        result['elapsed'].append(time.time() - start)
+        result['evaluations'].append(e.integrator.evaluations - evaluations if e.integrator is not None else steps)
+        current = e.iD[e.active_nodes]
+        result['meanCurrent'].append(float(current.mean()))
+        result['litFraction'].append(float((current > LIT_CURRENT).mean()))
+        result['summary'].append(metrics.Summary()[0])
+    return result
+
+
+# Whether the integrator's lit statistics stayed within TRACK_TOLERANCE of Euler's
+def TracksEuler(result, tolerance=TRACK_TOLERANCE):
+    litMean = [row['litMean'] for row in result['summary']]
+    if None not in litMean and abs(litMean[0] - litMean[1]) > tolerance:
+        return False
+    return abs(result['litFraction'][0] - result['litFraction'][1]) <= tolerance
+
+
+def ComparisonLines(result):
+    lines = ["%d Euler steps, metrics after the flash light:" % result['steps']]
+    lines.append("%-16s %12s %12s" % ('', 'integrator', 'euler'))
+    for name in METRICS:
+        values = [row[name] for row in result['summary']]
+        if None not in values:
+            lines.append("%-16s %12.4g %12.4g" % tuple([name] + values))
+    lines.append("%-16s %12.4f %12.4f" % tuple(['meanCurrent'] + result['meanCurrent']))
+    lines.append("%-16s %12.3f %12.3f" % tuple(['litFraction'] + result['litFraction']))
+    lines.append("%-16s %12d %12d" % tuple(['evaluations'] + result['evaluations']))
+    lines.append("%-16s %12.2f %12.2f" % tuple(['seconds'] + result['elapsed']))
+    lines.append("tracks Euler" if TracksEuler(result) else "doesn't track Euler")
+    return lines
+
+
+#                                                       Command line
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='gameoflight.integrate',
+                                     description='Compare an integrator with plain Euler steps')
+    parser.add_argument('--integrator', choices=('exponential', 'adaptive'), default='exponential')
+    parser.add_argument('--substeps', type=int, default=8, help='most Euler steps per step of the exponential integrator')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='vg / vd difference [V] allowed between a macro step and its two halves')
+    parser.add_argument('--steps', type=int, default=2000, help='Euler steps to run')
+    parser.add_argument('--grid', choices=('hex', 'square'), default='hex')
+    parser.add_argument('--width', type=int, default=41)
+    parser.add_argument('--height', type=int, default=41)
+    parser.add_argument('--psr', type=int, default=1)
+    parser.add_argument('--bfn', choices=B_FNS, default=B_3)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--variation', action='store_true', help='turn on the per-device variation')
+    parser.add_argument('--flash-steps', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    engine = ArrayEngine(args.width, args.height, HEX if args.grid == 'hex' else SQUARE, args.psr, args.bfn, args.seed)
+    engine.useVariation = args.variation
+    if args.integrator == 'exponential':
+        engine.integrator = ExponentialIntegrator(args.substeps, args.tolerance)
+    else:
+        engine.integrator = AdaptiveIntegrator(args.tolerance)
+    result = CompareWithEuler(engine, args.steps, args.flash_steps)
+    print('\n'.join(ComparisonLines(result)))
+    print(engine.integrator.Report())
+    return 0 if TracksEuler(result) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,179 @@
+
+#                                                       ABOUT
+
+# Online metrics of the LED field
+#       running statistics a run or sweep can be ranked by, updated after
+#       every observed step with a few array passes over the board and kept in
+#       constant memory, no frames are stored
+
+#       iDMean, iDVariance      LED current over every active node and step
+#       litMean                 fraction of active LEDs lit, averaged over steps
+#       flipRate                lit / unlit changes per node per step
+#       flippedFraction         fraction of nodes that changed at least once
+#       autocorrelation         Moran's I of iD between adjacent nodes,
+#                               averaged over steps, 1 for smooth blobs, near 0
+#                               for noise, negative for checkerboards
+#       patternEntropy          Shannon entropy [bits] of the lit patterns of
+#                               every 2 x 2 block of nodes seen over the run,
+#                               0 for a frozen uniform board, at most 4
+# A board off the HEX / SQUARE grids (engine.GraphEngine) has no adjacent pairs
+#       or blocks, its autocorrelation and patternEntropy stay 0
+# Ensembles are measured member by member
+
+import numpy as np
+
+from .engine import DenseField
+from .grid import HEX, SQUARE
+
+
+#                                                       CONSTANTS
+
+LIT_CURRENT = 1.0       # LED current above which an LED counts as lit
+
+# Neighbor offsets, each adjacent pair counted once, none off the HEX / SQUARE grids
+PAIR_OFFSETS = {HEX: ((1, 0), (0, 1), (1, 1)),
+                SQUARE: ((1, 0), (0, 1))}
+
+# 2 x 2 block corners, bit k of a block's pattern is corner k lit
+BLOCK_OFFSETS = ((0, 0), (1, 0), (0, 1), (1, 1))
+
+METRICS = ('iDMean', 'iDVariance', 'litMean', 'flipRate', 'flippedFraction', 'autocorrelation', 'patternEntropy')
+
+
+# iD of any engine over the interior
+def _Current(engine, xs, ys):
+    return DenseField(engine, 'iD')[..., xs, ys]
+
+
+# field[..., x, y] and field[..., x + dx, y + dy] over every (x, y) where both are on the board
+def _Pair(field, dx, dy):
+    w, h = field.shape[-2:]
+    return field[..., :w - dx, :h - dy], field[..., dx:, dy:]
+
+
+class OnlineMetrics(object):
+
+    def __init__(self, litCurrent=LIT_CURRENT):
+        self.litCurrent = litCurrent
+        self.steps = 0
+        self.firstStep = self.lastStep = None     # step numbers given to Observe, for the per step rates
+        self.samples = 0
+        self.nodes = 0          # active nodes at the last step, for the per node rates
+        self.mean = self.m2 = self.litSum = None
+        self.autoSum = self.autoSteps = None
+        self.flips = self.lastLit = self.patterns = None
+
+    def _Start(self, iD):
+        batchShape = iD.shape[:-2]
+        self.mean = np.zeros(batchShape)
+        self.m2 = np.zeros(batchShape)
+        self.litSum = np.zeros(batchShape)
+        self.autoSum = np.zeros(batchShape)
+        self.autoSteps = np.zeros(batchShape, dtype=np.int64)
+        self.flips = np.zeros(iD.shape, dtype=np.int32)
+        self.patterns = np.zeros(batchShape + (1 << len(BLOCK_OFFSETS),), dtype=np.int64)
+
+    # Add the board as it is after a step
+    def Observe(self, engine, step=None):
+        psr = engine.psr
+        xs, ys = slice(psr, engine.w - psr), slice(psr, engine.h - psr)
+        iD = _Current(engine, xs, ys)
+        active = np.asarray(engine.active_nodes[xs, ys], dtype=bool)
+        if self.mean is None:
+            self._Start(iD)
+        n = int(active.sum())
+        if not n:
+            return
+        self.nodes = n
+        if step is not None:
+            if self.firstStep is None:
+                self.firstStep = step
+            self.lastStep = step
+
+        # mean and variance over all samples, merged a step at a time (Chan et al.)
+        values = iD[..., active]
+        mean = values.mean(axis=-1)
+        m2 = ((values - mean[..., None]) ** 2).sum(axis=-1)
+        total = self.samples + n
+        delta = mean - self.mean
+        self.mean += delta * (n / float(total))
+        self.m2 += m2 + delta * delta * (self.samples * n / float(total))
+        self.samples = total
+
+        lit = (iD > self.litCurrent) & active
+        self.litSum += lit[..., active].mean(axis=-1)
+        if self.lastLit is not None:
+            self.flips += lit != self.lastLit
+        self.lastLit = lit
+
+        # Moran's I over adjacent active pairs
+        centered = np.where(active, iD - mean[..., None, None], 0)
+        products, pairs = 0, 0
+        for dx, dy in PAIR_OFFSETS.get(engine.grid, ()):
+            a, b = _Pair(centered, dx, dy)
+            both = np.logical_and(*_Pair(active, dx, dy))
+            products = products + (a * b).sum(axis=(-2, -1))
+            pairs += int(both.sum())
+        variance = m2 / n
+        moving = variance > 0
+        if pairs:
+            self.autoSum += np.where(moving, products / pairs / np.where(moving, variance, 1), 0)
+            self.autoSteps += moving
+
+        # 2 x 2 block patterns of fully active blocks
+        w, h = lit.shape[-2:]
+        code = np.zeros(lit.shape[:-2] + (w - 1, h - 1), dtype=np.intp)
+        whole = np.ones((w - 1, h - 1), dtype=bool)
+        for k, (dx, dy) in enumerate(BLOCK_OFFSETS):
+            code |= lit[..., dx:w - 1 + dx, dy:h - 1 + dy].astype(np.intp) << k
+            whole &= active[dx:w - 1 + dx, dy:h - 1 + dy]
+        patterns = self.patterns.reshape(-1, self.patterns.shape[-1])
+        for member, codes in zip(patterns, code.reshape(patterns.shape[:1] + whole.shape)):
+            member += np.bincount(codes[whole], minlength=len(member))
+        self.steps += 1
+
+    # One dict of METRICS per member, a single one for a plain engine
+    def Summary(self):
+        if self.mean is None:
+            return [dict((name, None) for name in METRICS)]
+        members = self.mean.size
+        mean, m2 = self.mean.ravel(), self.m2.ravel()
+        litSum, autoSum, autoSteps = self.litSum.ravel(), self.autoSum.ravel(), self.autoSteps.ravel()
+        flips = self.flips.reshape(members, -1)
+        counts = self.patterns.reshape(members, -1)
+        nodes = float(max(self.nodes, 1))
+        # steps between the first and last observation, which an integrator
+        #       taking several Euler steps per Step() spreads further apart
+        span = self.steps - 1 if self.firstStep is None else self.lastStep - self.firstStep
+        rows = []
+        for k in range(members):
+            p = counts[k][counts[k] > 0] / float(max(counts[k].sum(), 1))
+            rows.append({'iDMean': float(mean[k]),
+                         'iDVariance': float(m2[k] / max(self.samples, 1)),
+                         'litMean': float(litSum[k] / max(self.steps, 1)),
+                         'flipRate': float(flips[k].sum() / nodes / max(span, 1)),
+                         'flippedFraction': float(np.count_nonzero(flips[k]) / nodes),
+                         'autocorrelation': float(autoSum[k] / max(autoSteps[k], 1)),
+                         'patternEntropy': float(-(p * np.log2(p)).sum()) + 0.0})
+        return rows
+
+    def Lines(self):
+        rows = self.Summary()
+        lines = []
+        for k, row in enumerate(rows):
+            text = ', '.join("%s %.4g" % (name, row[name]) for name in METRICS if row[name] is not None)
+            lines.append(text if len(rows) == 1 else "member %d: %s" % (k, text))
+        return lines
+
+
+# Table column of a metric, '-' for one that wasn't measured (a run that
+#       ended before the flash light went off)
+def MetricColumn(value):
+    return " %15s" % '-' if value is None else " %15.4g" % value
+
+
+# Rows sorted by the metric name, highest first, rows without it left unranked at the end
+def RankRows(rows, name):
+    measured = [row for row in rows if row.get(name) is not None]
+    measured.sort(key=lambda row: row[name], reverse=True)
+    return measured + [row for row in rows if row.get(name) is None]
@@ -0,0 +1,242 @@
+
+#                                                       ABOUT
+
+# Packed engine
+#       stores only the active nodes, in 1-D arrays, with a precomputed table
+#       of where each node's stencil neighbors live in those arrays
+
+# Slot 0 is a dark node that is never updated (iD stays 0), every missing or
+#       inactive neighbor points at it, live nodes sit in slots 1..n
+# Toggling a node patches the table rows of the node and the nodes that sense
+#       it, so a toggle costs O(stencil size) no matter how big the board is
+# A node switched off is only unpacked after the next brightness sum, as the
+#       dense engines still let its neighbors see its last iD for one step
+
+import numpy as np
+
+from .circuit import VG_STEP_SCALE, VD_STEP_SCALE, P_SENSITIVITY, P_VREF_LOW, P_VREF_HIGH
+from .engine import STATE_FIELDS, NewSeed, ClippedDisk, GateVoltage, InverseResistance, DrainVoltage, IdAtVd
+from .grid import HEX, B_3, ActiveNodes, Stencil, StencilReach
+from .timing import NULL_TIMER, BRIGHTNESS, CIRCUIT, CURRENT
+
+
+MIN_CAPACITY = 16
+
+
+class PackedEngine(object):
+
+    timer = NULL_TIMER      # per phase step timing, see timing.PhaseTimer
+
+    def __init__(self, w=41, h=41, grid=HEX, psr=1, bFn=B_3, seed=None):
+        self.w = w
+        self.h = h
+        self.grid = grid
+        self.psr = psr
+        self.seed = seed = NewSeed() if seed is None else seed
+
+        self.vgStepScale = VG_STEP_SCALE
+        self.vdStepScale = VD_STEP_SCALE
+        self.pSensitivity = P_SENSITIVITY
+        self.pVRefLow = P_VREF_LOW
+        self.pVRefHigh = P_VREF_HIGH
+        self.useVariation = False
+
+        # board wide maps, only read at live nodes while stepping
+        rng = np.random.RandomState(seed)
+        self.pSensVariation = rng.random_sample((w, h)) * 0.2 + 0.9
+        self.idVariation = rng.random_sample((w, h)) * 0.2 + 0.9
+        self.b_ext = np.zeros((w, h))
+        self.active_nodes = np.zeros((w, h), dtype=bool)
+        self.slot = np.zeros((w, h), dtype=np.int32)      # packed slot of each node, 0 if inactive
+
+        self.stencil = None
+        self.SetBrightnessFn(bFn)
+        self.ResetActiveNodes()
+
+    def SetBrightnessFn(self, bFn):
+        stencil = Stencil(bFn, self.grid, self.psr)
+        if StencilReach(stencil) > self.psr:
+            raise ValueError("%s needs PSR >= %d" % (bFn, StencilReach(stencil)))
+        self.bFn = bFn
+        self.stencil = stencil
+        self.offsets = [offset for weight, offsets in stencil for offset in offsets]
+        if self.active_nodes.any():
+            self._Pack(self.active_nodes)
+
+    # Rebuild the packed arrays and neighbor table from a dense active map,
+    #       keeping the state of nodes that stay active
+    def _Pack(self, active):
+        active = active.copy()
+        active[:self.psr, :] = False
+        active[self.w - self.psr:, :] = False
+        active[:, :self.psr] = False
+        active[:, self.h - self.psr:] = False
+        x_pos, y_pos = np.nonzero(active)
+        n = len(x_pos)
+        capacity = max(n, MIN_CAPACITY)
+
+        state = np.zeros((len(STATE_FIELDS), capacity + 1))
+        if hasattr(self, 'state'):
+            state[:, 1:n + 1] = self.state[:, self.slot[x_pos, y_pos]]
+
+        self.state = state
+        self.b, self.vg, self.rqi, self.vd, self.iD = self.state
+        self.x_pos = np.zeros(capacity + 1, dtype=np.int32)
+        self.y_pos = np.zeros(capacity + 1, dtype=np.int32)
+        self.x_pos[1:n + 1] = x_pos
+        self.y_pos[1:n + 1] = y_pos
+        self.n = n
+        self.dying = set()
+
+        self.active_nodes[...] = active
+        self.slot.fill(0)
+        self.slot[x_pos, y_pos] = np.arange(1, n + 1)
+
+        self.neighbors = np.zeros((len(self.offsets), capacity + 1), dtype=np.int32)
+        for col, (dx, dy) in enumerate(self.offsets):
+            self.neighbors[col, 1:n + 1] = self.slot[x_pos + dx, y_pos + dy]
+
+    def _Grow(self):
+        capacity = 2 * (len(self.x_pos) - 1)
+        pad = capacity + 1 - len(self.x_pos)
+        self.state = np.pad(self.state, ((0, 0), (0, pad)))
+        self.b, self.vg, self.rqi, self.vd, self.iD = self.state
+        self.x_pos = np.pad(self.x_pos, (0, pad))
+        self.y_pos = np.pad(self.y_pos, (0, pad))
+        self.neighbors = np.pad(self.neighbors, ((0, 0), (0, pad)))
+
+    # Point every live node that senses (x, y) at slot s
+    def _Relink(self, x, y, s):
+        for col, (dx, dy) in enumerate(self.offsets):
+            q = self.slot[x - dx, y - dy]
+            if q:
+                self.neighbors[col, q] = s
+
+    def _Interior(self, x, y):
+        return self.psr <= x < self.w - self.psr and self.psr <= y < self.h - self.psr
+
+    # Switch node (x, y) on or off, new nodes power up with zero state
+    def SetNode(self, x, y, on):
+        on = bool(on)
+        if not self._Interior(x, y) or bool(self.active_nodes[x, y]) == on:
+            return
+        self.active_nodes[x, y] = on
+        if not on:
+            self.dying.add((x, y))
+        elif (x, y) in self.dying:
+            self.dying.discard((x, y))
+        else:
+            self._Add(x, y)
+
+    def _Add(self, x, y):
+        if self.n + 1 >= len(self.x_pos):
+            self._Grow()
+        self.n += 1
+        s = self.n
+        self.state[:, s] = 0
+        self.x_pos[s] = x
+        self.y_pos[s] = y
+        self.slot[x, y] = s
+        for col, (dx, dy) in enumerate(self.offsets):
+            self.neighbors[col, s] = self.slot[x + dx, y + dy]
+        self._Relink(x, y, s)
+
+    # Unpack node (x, y), the last live node moves into its slot
+    def _Remove(self, x, y):
+        s = self.slot[x, y]
+        last = self.n
+        self._Relink(x, y, 0)
+        self.slot[x, y] = 0
+        if s != last:
+            lx, ly = self.x_pos[last], self.y_pos[last]
+            self.state[:, s] = self.state[:, last]
+            self.x_pos[s] = lx
+            self.y_pos[s] = ly
+            self.neighbors[:, s] = self.neighbors[:, last]
+            self.slot[lx, ly] = s
+            self._Relink(lx, ly, s)
+        self.state[:, last] = 0
+        self.neighbors[:, last] = 0
+        self.n -= 1
+
+    def ToggleNode(self, x, y):
+        self.SetNode(x, y, not self.active_nodes[x, y])
+
+    # Nodes are packed one at a time, only the tool's footprint is found as a slice
+    def ToggleNodes(self, x, y, r):
+        region, mask = ClippedDisk(self.grid, r, x, y, self.w, self.h)
+        if region is not None:
+            for i, j in zip(*np.nonzero(mask)):
+                self.ToggleNode(region[0].start + int(i), region[1].start + int(j))
+
+    def PowerCycle(self):
+        self.state.fill(0)
+        self.b_ext.fill(0)
+
+    def ResetActiveNodes(self):
+        self._Pack(np.array(ActiveNodes(self.grid, self.w, self.h), dtype=bool))
+
+    # Shine the flash light tool of radius r centered on node (x, y)
+    def FlashLight(self, x, y, r, brightness):
+        region, mask = ClippedDisk(self.grid, r, x, y, self.w, self.h)
+        if region is not None:
+            self.b_ext[region][mask] = brightness
+
+    def ClearFlashLight(self):
+        self.b_ext.fill(0)
+
+    # Packed field scattered back onto the [x][y] board, zero at inactive nodes
+    def Dense(self, name):
+        dense = np.zeros((self.w, self.h))
+        live = slice(1, self.n + 1)
+        dense[self.x_pos[live], self.y_pos[live]] = getattr(self, name)[live]
+        return dense
+
+    # Positions and LED currents of the nodes a renderer should draw
+    def DrawnNodes(self):
+        live = slice(1, self.n + 1)
+        return self.x_pos[live], self.y_pos[live], self.iD[live]
+
+    def Step(self):
+        live = slice(1, self.n + 1)
+        x_pos, y_pos = self.x_pos[live], self.y_pos[live]
+        iD = self.iD
+
+        with self.timer.Phase(BRIGHTNESS):
+            light = None
+            col = 0
+            for weight, offsets in self.stencil:
+                group = iD[self.neighbors[col, live]]
+                for k in range(1, len(offsets)):
+                    group += iD[self.neighbors[col + k, live]]
+                col += len(offsets)
+                if weight != 1.0:
+                    group *= weight
+                if light is None:
+                    light = group
+                else:
+                    light += group
+
+        with self.timer.Phase(CIRCUIT):
+            b = light
+            b += self.b_ext[x_pos, y_pos]
+            light = b * self.pSensitivity
+            if self.useVariation:
+                light *= self.pSensVariation[x_pos, y_pos]
+
+            self.b[live] = b
+            self.vg[live] = GateVoltage(self.vg[live], light, self.pVRefLow, self.pVRefHigh, self.vgStepScale)
+            self.rqi[live] = InverseResistance(self.vg[live])
+            self.vd[live] = DrainVoltage(self.vd[live], self.rqi[live], iD[live], self.vdStepScale)
+
+        for x, y in self.dying:
+            self._Remove(x, y)
+        self.dying = set()
+        live = slice(1, self.n + 1)
+        x_pos, y_pos = self.x_pos[live], self.y_pos[live]
+
+        with self.timer.Phase(CURRENT):
+            current = IdAtVd(self.vd[live])
+            if self.useVariation:
+                current *= self.idVariation[x_pos, y_pos]
+            iD[live] = current
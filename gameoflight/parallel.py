@@ -0,0 +1,141 @@
+
+#                                                       ABOUT
+
+# Multi-core domain decomposition for large grids
+#       the interior is cut into strips of x, one worker process per strip,
+#       with all engine state in shared memory
+
+# Every step each worker updates its strip's circuit reading iD from its own
+#       rows plus a PSR wide halo of rows owned by its neighbors, waits at a
+#       barrier, writes its strip's iD and waits again, so no worker ever reads
+#       a halo that is half written. Each node goes through exactly the same
+#       array operations as in ArrayEngine, so results are bit for bit identical
+#       as long as the brightness sums are direct, which is the default here
+#       (FFT sums round differently per strip)
+
+import multiprocessing
+import os
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from .convolve import DIRECT
+from .engine import ArrayEngine, TUNABLES
+from .grid import HEX, B_3
+
+
+#                                                       Worker side
+
+class _TileEngine(ArrayEngine):
+
+    # ArrayEngine attached to state already laid out in shared memory
+    def __init__(self, spec, blocks):
+        self.w, self.h, self.grid, self.psr, bFn = spec
+        self.interior = (slice(self.psr, self.w - self.psr), slice(self.psr, self.h - self.psr))
+        self.blocks = blocks
+        self.shared = {}
+        for name in ('state', 'b_ext', 'active_nodes', 'pSensVariation', 'idVariation'):
+            setattr(self, name, self.NewArray(name, None))
+        self.b, self.vg, self.rqi, self.vd, self.iD = self.state
+        self.SetBrightnessFn(bFn)
+
+    def NewArray(self, name, shape, dtype=float):
+        blockName, shape, dtype = self.blocks[name]
+        self.shared[name] = shared_memory.SharedMemory(name=blockName)
+        return np.ndarray(shape, dtype, buffer=self.shared[name].buf)
+
+
+def _TileWorker(conn, spec, blocks, bounds, barrier):
+    engine = _TileEngine(spec, blocks)
+    xs = slice(*bounds)
+    ys = engine.interior[1]
+    while True:
+        command = conn.recv()
+        if command[0] == 'close':
+            break
+        steps, tunables, bFn, mode = command[1:]
+        for name, value in tunables.items():
+            setattr(engine, name, value)
+        if (bFn, mode) != (engine.bFn, engine.brightnessMode):
+            engine.brightnessMode = mode
+            engine.SetBrightnessFn(bFn)
+        for i in range(steps):
+            engine.UpdateCircuit(xs, ys)
+            barrier.wait()
+            engine.UpdateCurrent(xs, ys)
+            barrier.wait()
+        conn.send(steps)
+    conn.close()
+
+
+#                                                       Engine
+
+class TiledEngine(ArrayEngine):
+
+    brightnessMode = DIRECT
+
+    # tiles defaults to one per CPU, capped at one per interior column
+    def __init__(self, w=41, h=41, grid=HEX, psr=1, bFn=B_3, seed=None, tiles=None):
+        self.shared = {}
+        self.blocks = {}
+        ArrayEngine.__init__(self, w, h, grid, psr, bFn, seed)
+
+        tiles = min(tiles or os.cpu_count() or 1, w - 2 * psr)
+        edges = np.linspace(psr, w - psr, tiles + 1).astype(int)
+        self.tiles = [(int(x0), int(x1)) for x0, x1 in zip(edges[:-1], edges[1:])]
+
+        context = multiprocessing.get_context()
+        barrier = context.Barrier(tiles)
+        spec = (w, h, grid, psr, bFn)
+        self.pipes = []
+        self.workers = []
+        for bounds in self.tiles:
+            parent, child = context.Pipe()
+            worker = context.Process(target=_TileWorker, args=(child, spec, self.blocks, bounds, barrier))
+            worker.daemon = True
+            worker.start()
+            child.close()
+            self.pipes.append(parent)
+            self.workers.append(worker)
+
+    def NewArray(self, name, shape, dtype=float):
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.shared[name] = block
+        self.blocks[name] = (block.name, shape, dtype)
+        a = np.ndarray(shape, dtype, buffer=block.buf)
+        a.fill(0)
+        return a
+
+    # Advance all tiles by steps with a single round trip to the workers
+    def Advance(self, steps):
+        tunables = dict((name, getattr(self, name)) for name in TUNABLES)
+        for conn in self.pipes:
+            conn.send(('step', steps, tunables, self.bFn, self.brightnessMode))
+        for conn in self.pipes:
+            conn.recv()
+
+    def Step(self):
+        self.Advance(1)
+
+    # Stop the workers and free the shared memory, the engine can't step after this
+    def Close(self):
+        for conn in self.pipes:
+            conn.send(('close',))
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+        self.pipes = []
+        self.workers = []
+        self.b = self.vg = self.rqi = self.vd = self.iD = None
+        self.state = self.b_ext = self.active_nodes = self.pSensVariation = self.idVariation = None
+        for block in self.shared.values():
+            block.close()
+            block.unlink()
+        self.shared = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
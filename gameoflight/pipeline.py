@@ -0,0 +1,142 @@
+
+#                                                       ABOUT
+
+# Threaded simulation pipeline
+#       the engine steps on its own thread and publishes finished frames into a
+#       double buffer, the display thread draws the latest one at its own rate
+#       and hands inputs to the simulation, which applies them between steps
+
+# Double buffer protocol, with one display thread
+#       the simulation only fills the back buffer and swaps once the display
+#       has taken the front one, and the display only takes a new frame once
+#       it is done with the last, so neither ever touches the other's buffer
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+# A finished step's LEDs, shaped like an engine as far as the renderers care
+class Frame(object):
+
+    def __init__(self):
+        self.x_pos = self.y_pos = self.iD = self.b_ext = None
+        self.step = 0
+
+    def Fill(self, engine, step):
+        x_pos, y_pos, iD = engine.DrawnNodes()
+        self.x_pos, self.y_pos, self.iD = _CopyInto(self.x_pos, x_pos), _CopyInto(self.y_pos, y_pos), _CopyInto(self.iD, iD)
+        self.b_ext = _CopyInto(self.b_ext, engine.b_ext)
+        self.step = step
+
+    def DrawnNodes(self):
+        return self.x_pos, self.y_pos, self.iD
+
+
+def _CopyInto(target, source):
+    if target is None or target.shape != source.shape:
+        return np.array(source)
+    np.copyto(target, source)
+    return target
+
+
+class SimulationThread(object):
+
+    # step() advances the simulation one step (engine.Step by default)
+    #       maxRate caps steps per second, None steps flat out
+    def __init__(self, engine, step=None, maxRate=None):
+        self.engine = engine
+        self.step = step or engine.Step
+        self.maxRate = maxRate
+        self.inputs = queue.Queue()
+        self.lock = threading.Lock()
+        self.front, self.back = Frame(), Frame()
+        self.fresh = False          # front holds a frame the display hasn't taken yet
+        self.steps = 0
+        self.error = None
+        self.running = False
+        self.paused = False
+        self.rateSteps = 0
+        self.rateStart = time.time()
+        self.rate = 0.0
+        self.thread = None
+
+    def Start(self):
+        self.front.Fill(self.engine, 0)
+        self.fresh = True
+        self.running = True
+        self.thread = threading.Thread(target=self._Run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Call fn(*args) on the simulation thread before its next step
+    def Submit(self, fn, *args):
+        self.inputs.put((fn, args))
+
+    # Newest frame, or None if there is nothing new since the last one taken
+    def Latest(self):
+        if self.error is not None:
+            raise self.error
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.fresh = False
+            return self.front
+
+    def StepRate(self):
+        return self.rate
+
+    def _ApplyInputs(self):
+        while True:
+            try:
+                fn, args = self.inputs.get_nowait()
+            except queue.Empty:
+                return
+            fn(*args)
+
+    def _Run(self):
+        due = time.time()
+        try:
+            while self.running:
+                self._ApplyInputs()
+                if self.paused:
+                    time.sleep(0.01)
+                    continue
+                if self.maxRate:
+                    due += 1.0 / self.maxRate
+                    delay = due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        due = time.time()
+                self.step()
+                self.steps += 1
+                self._Publish()
+                self._CountRate()
+        except Exception as error:
+            self.error = error
+            self.running = False
+
+    def _Publish(self):
+        if self.fresh:
+            return
+        self.back.Fill(self.engine, self.steps)
+        with self.lock:
+            self.front, self.back = self.back, self.front
+            self.fresh = True
+
+    def _CountRate(self):
+        self.rateSteps += 1
+        elapsed = time.time() - self.rateStart
+        if elapsed >= 0.5:
+            self.rate = self.rateSteps / elapsed
+            self.rateSteps = 0
+            self.rateStart = time.time()
@@ -0,0 +1,186 @@
+
+#                                                       ABOUT
+
+# Trajectory recording
+#       LED current (iD) and flash light (b_ext) of every recorded step,
+#       quantized to bytes, delta coded and zlib compressed in chunks of frames
+#       by a background thread, so recording costs the stepping thread one
+#       quantizing copy per frame
+
+# Layout
+#       RECORD_MAGIC, the JSON header length as a little endian uint32, the JSON
+#       header, then chunks of (frames, compressed bytes) as little endian
+#       uint32s, the step number of each frame as uint64s and the zlib data
+#       A chunk holds frames x fields x W x H bytes, the first frame as is and
+#       every later one as its difference from the one before (mod 256)
+
+# Recording(path) reads a recording back, a frame at a time, for replay.py
+
+import json
+import queue
+import threading
+import zlib
+
+import numpy as np
+
+from .engine import DenseField
+
+
+#                                                       CONSTANTS
+
+RECORD_MAGIC = b'GOLREC\x00\x01'
+
+RECORD_FIELDS = ('iD', 'b_ext')
+
+ID_QUANTUM = 1 / 7.0        # iD per recorded level, the LED color step of render.LedColor
+B_EXT_QUANTUM = 1.0
+
+CHUNK_FRAMES = 64
+CHUNK_QUEUE = 16            # chunks waiting for the writer before the stepping thread blocks
+
+_CHUNK_HEADER = np.dtype([('frames', '<u4'), ('nbytes', '<u4')])
+
+
+class Recorder(object):
+
+    # Records frames of engine's board, level is the zlib compression level
+    def __init__(self, path, engine, chunkFrames=CHUNK_FRAMES, level=6):
+        self.path = path
+        self.w, self.h = engine.w, engine.h
+        self.chunkFrames = chunkFrames
+        self.level = level
+        self.header = {'w': engine.w, 'h': engine.h, 'grid': engine.grid, 'psr': engine.psr,
+                       'fields': list(RECORD_FIELDS),
+                       'quanta': [ID_QUANTUM, B_EXT_QUANTUM], 'chunkFrames': chunkFrames}
+        self.file = open(path, 'wb')
+        text = json.dumps(self.header).encode('utf-8')
+        self.file.write(RECORD_MAGIC)
+        self.file.write(np.uint32(len(text)).tobytes())
+        self.file.write(text)
+
+        self.frames = 0
+        self.chunk = self._NewChunk()
+        self.steps = np.empty(chunkFrames, dtype='<u8')
+        self.filled = 0
+        self.queue = queue.Queue(CHUNK_QUEUE)
+        self.writer = threading.Thread(target=self._Write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _NewChunk(self):
+        return np.empty((self.chunkFrames, len(RECORD_FIELDS), self.w, self.h), dtype=np.uint8)
+
+    # Record the engine's current frame as step (frames counted so far by default)
+    def Add(self, engine, step=None):
+        if step is None:
+            step = self.frames
+        frame = self.chunk[self.filled]
+        for k, (field, quantum) in enumerate(((DenseField(engine, 'iD'), ID_QUANTUM), (engine.b_ext, B_EXT_QUANTUM))):
+            frame[k] = np.clip(field * (1 / quantum), 0, 255)
+        self.steps[self.filled] = step
+        self.filled += 1
+        self.frames += 1
+        if self.filled == self.chunkFrames:
+            self._Flush()
+
+    def _Flush(self):
+        if self.filled:
+            self.queue.put((self.chunk[:self.filled], self.steps[:self.filled]))
+            self.chunk = self._NewChunk()
+            self.steps = np.empty(self.chunkFrames, dtype='<u8')
+            self.filled = 0
+
+    # Runs on the writer thread, zlib releases the GIL while it compresses
+    def _Write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            chunk, steps = item
+            chunk[1:] -= chunk[:-1].copy()
+            data = zlib.compress(chunk.tobytes(), self.level)
+            self.file.write(np.array([(len(chunk), len(data))], dtype=_CHUNK_HEADER).tobytes())
+            self.file.write(steps.tobytes())
+            self.file.write(data)
+
+    # Write out the partly filled chunk and wait for the writer to finish
+    def Close(self):
+        if self.file is None:
+            return
+        self._Flush()
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+
+class Recording(object):
+
+    # The chunk index is built by skipping from chunk header to chunk header,
+    #       frames are only decompressed when asked for
+    def __init__(self, path, cacheChunks=4):
+        self.path = path
+        self.file = open(path, 'rb')
+        if self.file.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError("%s is not a Game of Light recording" % path)
+        length = int(np.frombuffer(self.file.read(4), dtype='<u4')[0])
+        self.header = json.loads(self.file.read(length).decode('utf-8'))
+        for key in ('w', 'h', 'grid', 'psr'):
+            setattr(self, key, self.header[key])
+        self.quanta = self.header['quanta']
+
+        self.chunks = []        # (first frame, frames, offset, nbytes)
+        steps = []
+        frame = 0
+        while True:
+            raw = self.file.read(_CHUNK_HEADER.itemsize)
+            if len(raw) < _CHUNK_HEADER.itemsize:
+                break
+            frames, nbytes = np.frombuffer(raw, dtype=_CHUNK_HEADER)[0].tolist()
+            steps.append(np.frombuffer(self.file.read(8 * frames), dtype='<u8'))
+            self.chunks.append((frame, frames, self.file.tell(), nbytes))
+            self.file.seek(nbytes, 1)
+            frame += frames
+        self.frames = frame
+        self.steps = np.concatenate(steps) if steps else np.zeros(0, dtype='<u8')
+        self.starts = np.array([c[0] for c in self.chunks], dtype=int)
+        self.cacheChunks = cacheChunks
+        self.cache = {}
+
+    def __len__(self):
+        return self.frames
+
+    def _Chunk(self, index):
+        chunk = self.cache.pop(index, None)
+        if chunk is None:
+            first, frames, offset, nbytes = self.chunks[index]
+            self.file.seek(offset)
+            data = zlib.decompress(self.file.read(nbytes))
+            shape = (frames, len(self.header['fields']), self.w, self.h)
+            chunk = np.cumsum(np.frombuffer(data, dtype=np.uint8).reshape(shape), axis=0, dtype=np.uint8)
+            if len(self.cache) >= self.cacheChunks:
+                self.cache.pop(next(iter(self.cache)))
+        self.cache[index] = chunk       # most recently used last
+        return chunk
+
+    # Recorded levels of frame i, (fields, W, H) uint8
+    def Levels(self, i):
+        if not 0 <= i < self.frames:
+            raise IndexError("frame %d of %d" % (i, self.frames))
+        index = int(np.searchsorted(self.starts, i, side='right')) - 1
+        return self._Chunk(index)[i - self.chunks[index][0]]
+
+    # iD and b_ext of frame i, each level read back as the middle of its range
+    #       steps[i] is the step it was recorded at
+    def Frame(self, i):
+        levels = self.Levels(i)
+        return [(levels[k] + 0.5) * quantum * (levels[k] > 0) for k, quantum in enumerate(self.quanta)]
+
+    def Close(self):
+        self.file.close()
@@ -0,0 +1,200 @@
+
+#                                                       ABOUT
+
+# Per-node reference engine
+#       a straight port of the nested list Step() from Game of Light.py, kept
+#       as the ground truth the array engines are checked against
+
+import random
+
+from .circuit import (VDD, VN, VP, RQI_BASE, Id_at_Vd, VariationField,
+                      VG_STEP_SCALE, VD_STEP_SCALE, P_SENSITIVITY, P_VREF_LOW, P_VREF_HIGH)
+from .grid import HEX, B_3, B_6, B_4, B_HEX, B_SQUARE, DistanceTable, ActiveNodes, DiskOffsets
+
+
+class ListEngine(object):
+
+    def __init__(self, w=41, h=41, grid=HEX, psr=1, bFn=B_3, seed=None):
+        self.w = w
+        self.h = h
+        self.grid = grid
+        self.psr = psr
+        self.bFn = bFn
+        self.seed = seed
+
+        self.vgStepScale = VG_STEP_SCALE
+        self.vdStepScale = VD_STEP_SCALE
+        self.pSensitivity = P_SENSITIVITY
+        self.pVRefLow = P_VREF_LOW
+        self.pVRefHigh = P_VREF_HIGH
+        self.useVariation = False
+
+        rng = random.Random(seed)
+        self.pSensVariation = VariationField(w, h, rng)
+        self.idVariation = VariationField(w, h, rng)
+
+        self.d = DistanceTable(grid, psr)
+        self.active_nodes = ActiveNodes(grid, w, h)
+        self.PowerCycle()
+
+    def PowerCycle(self):
+        w, h = self.w, self.h
+        self.b = [[0 for i in range(h)] for j in range(w)]
+        self.vg = [[0 for i in range(h)] for j in range(w)]
+        self.rqi = [[0 for i in range(h)] for j in range(w)]
+        self.vd = [[0 for i in range(h)] for j in range(w)]
+        self.iD = [[0 for i in range(h)] for j in range(w)]
+        self.b_ext = [[0 for i in range(h)] for j in range(w)]
+
+    def ResetActiveNodes(self):
+        self.active_nodes = ActiveNodes(self.grid, self.w, self.h)
+
+    # Shine the flash light tool of radius r centered on node (x, y)
+    def FlashLight(self, x, y, r, brightness):
+        for i, j in DiskOffsets(self.grid, r):
+            if 0 <= x + i < self.w and 0 <= y + j < self.h:
+                self.b_ext[x + i][y + j] = brightness
+
+    def ClearFlashLight(self):
+        self.b_ext = [[0 for i in range(self.h)] for j in range(self.w)]
+
+    # Brightness functions
+
+    def B_hex(self, x, y):
+        iD, d = self.iD, self.d
+        light_sensed = 0.0
+        for i in range(1, self.psr + 1):
+            for j in range(self.psr + 1):
+                light_sensed += d[i][j] * (iD[x + i][y + j] +
+                                           iD[x - j][y + i - j] +
+                                           iD[x + j - i][y - i])
+        self.b[x][y] = light_sensed + self.b_ext[x][y]
+
+    def B_square(self, x, y):
+        iD, d = self.iD, self.d
+        light_sensed = 0.0
+        for i in range(1, self.psr + 1):
+            for j in range(self.psr + 1):
+                light_sensed += d[i][j] * (iD[x + i][y + j] +
+                                           iD[x - j][y + i] +
+                                           iD[x - i][y - j] +
+                                           iD[x + j][y - i])
+        self.b[x][y] = light_sensed + self.b_ext[x][y]
+
+    def B_6(self, x, y):
+        iD = self.iD
+        light_sensed = (iD[x + 1][y] + iD[x + 1][y + 1] +
+                        iD[x][y + 1] + iD[x - 1][y] +
+                        iD[x - 1][y - 1] + iD[x][y - 1])
+        self.b[x][y] = light_sensed + self.b_ext[x][y]
+
+    def B_3(self, x, y):
+        iD = self.iD
+        light_sensed = (iD[x + 1][y] + iD[x][y + 1] + iD[x - 1][y - 1])
+        self.b[x][y] = light_sensed + self.b_ext[x][y]
+
+    def B_4(self, x, y):
+        iD = self.iD
+        light_sensed = (iD[x + 1][y] + iD[x][y + 1] + iD[x][y - 1] + iD[x - 1][y])
+        self.b[x][y] = light_sensed + self.b_ext[x][y]
+
+    # Circuit functions
+
+    def VG(self, x, y):
+        vg = self.vg
+        light = self.b[x][y] * self.pSensitivity
+        if self.useVariation:
+            light *= self.pSensVariation[x][y]
+        vg[x][y] += (light + self.pVRefLow - vg[x][y]) * self.vgStepScale
+        if vg[x][y] > self.pVRefHigh:
+            vg[x][y] = self.pVRefHigh
+
+    def RQi(self, x, y):
+        rqi = self.rqi
+        rqi[x][y] = (self.vg[x][y] - VN)*(VP - self.vg[x][y]) * RQI_BASE
+        if rqi[x][y] < 0:
+            rqi[x][y] = 0
+
+    def VD(self, x, y):
+        vd = self.vd
+        vd[x][y] += ((VDD - vd[x][y])*self.rqi[x][y] - self.iD[x][y]) * self.vdStepScale
+        if vd[x][y] > VDD:
+            vd[x][y] = VDD
+
+    def Id_at_Vd(self, x, y):
+        if self.useVariation:
+            return Id_at_Vd(self.vd[x][y]) * self.idVariation[x][y]
+        return Id_at_Vd(self.vd[x][y])
+
+    def Step(self):
+        B_fn = {B_3: self.B_3, B_6: self.B_6, B_4: self.B_4,
+                B_HEX: self.B_hex, B_SQUARE: self.B_square}[self.bFn]
+        psr = self.psr
+        active_nodes = self.active_nodes
+        for x in range(psr, self.w - psr):
+            for y in range(psr, self.h - psr):
+                if active_nodes[x][y] == 1:
+                    B_fn(x, y)
+                    self.VG(x, y)
+                    self.RQi(x, y)
+                    self.VD(x, y)
+                else:
+                    self.b[x][y] = 0
+                    self.vg[x][y] = 0
+                    self.rqi[x][y] = 0
+                    self.vd[x][y] = 0
+        for x in range(psr, self.w - psr):
+            for y in range(psr, self.h - psr):
+                if active_nodes[x][y] == 1:
+                    self.iD[x][y] = self.Id_at_Vd(x, y)
+                else:
+                    self.iD[x][y] = 0
+
+
+#                                                       Validation
+
+# Largest difference allowed between one step of an engine and one step of
+#       the reference from the same state (volts for vg / vd, LED current for iD)
+# The per-node path squares with pow() and the array engines with v*v, which
+#       differ in the last bit now and then; over many steps the grid is chaotic
+#       enough to amplify that, so engines are re-synced to the reference after
+#       every step and only the single step error is compared
+MATCH_TOLERANCE = 1e-9
+
+STATE_FIELDS = ('b', 'vg', 'rqi', 'vd', 'iD')     # same order as engine.STATE_FIELDS
+
+
+def _ToList(a):
+    return a.tolist() if hasattr(a, 'tolist') else a
+
+
+# Largest absolute difference between two [x][y] fields
+def MaxDeviation(a, b):
+    a, b = _ToList(a), _ToList(b)
+    return max(abs(u - v) for row_a, row_b in zip(a, b) for u, v in zip(row_a, row_b))
+
+
+# Run an engine side by side with a ListEngine set up the same way
+#       the flash light is held on the grid center for flashSteps, then removed
+#       returns the largest single step deviation over b, vg, rqi, vd and iD
+def CompareWithReference(engine, steps=400, flashSteps=100, r=2, brightness=140):
+    reference = ListEngine(engine.w, engine.h, engine.grid, engine.psr, engine.bFn)
+    for name in ('vgStepScale', 'vdStepScale', 'pSensitivity', 'pVRefLow', 'pVRefHigh', 'useVariation'):
+        setattr(reference, name, getattr(engine, name))
+    reference.pSensVariation = _ToList(engine.pSensVariation)
+    reference.idVariation = _ToList(engine.idVariation)
+    reference.active_nodes = [[int(v) for v in row] for row in _ToList(engine.active_nodes)]
+
+    for e in (engine, reference):
+        e.FlashLight(engine.w // 2, engine.h // 2, r, brightness)
+    deviation = 0.0
+    for step in range(steps):
+        if step == flashSteps:
+            engine.ClearFlashLight()
+            reference.ClearFlashLight()
+        engine.Step()
+        reference.Step()
+        for name in STATE_FIELDS:
+            deviation = max(deviation, MaxDeviation(getattr(engine, name), getattr(reference, name)))
+            getattr(engine, name)[...] = getattr(reference, name)
+    return deviation
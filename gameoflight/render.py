@@ -0,0 +1,117 @@
+
+#                                                       ABOUT
+
+# Renderers that draw an engine's LED field into a pygame surface
+#       only imported by front ends, the engines never touch pygame
+
+import numpy as np
+import pygame
+
+from .grid import DotPositions
+
+
+# LED color for flash light brightness and LED current
+def LedColor(b_ext, iD):
+    bp = int(iD * 7)
+    return (int(b_ext), bp, bp)
+
+
+# One pygame.draw.circle per node, as the original Step() did
+class CircleRenderer(object):
+
+    def __init__(self, window, w, h, grid, ds=28, dr=12):
+        self.window = window
+        self.dr = dr
+        self.dot_x_pos, self.dot_y_pos = DotPositions(grid, w, h, ds)
+
+    # Draws the nodes the engine reports through DrawnNodes(), which for the
+    #       packed engine are only the live ones
+    def Draw(self, engine):
+        x_pos, y_pos, iD = engine.DrawnNodes()
+        b_ext = engine.b_ext[x_pos, y_pos]
+        dot_x_pos, dot_y_pos, dr = self.dot_x_pos, self.dot_y_pos, self.dr
+        for x, y, b, i in zip(x_pos.tolist(), y_pos.tolist(), b_ext.tolist(), iD.tolist()):
+            pygame.draw.circle(self.window, LedColor(b, i), (dot_x_pos[x][y], dot_y_pos[y]), dr, 0)
+
+
+# Whole board at once: LED colors are worked out as arrays, only the dots
+#       whose color changed since the last frame are written, straight into
+#       the window's pixels one stamp offset at a time, and Draw() returns the
+#       rectangles that need a display update
+# Dots are stamped with exactly the pixels pygame.draw.circle would set, dots
+#       that would be clipped by the window edge are drawn with draw.circle
+class ArrayRenderer(object):
+
+    DIRTY_FULL_FRACTION = 0.25  # changed dots past which the whole window is updated in one rect
+
+    def __init__(self, window, w, h, grid, ds=28, dr=12):
+        self.window = window
+        self.w, self.h = w, h
+        self.dr = dr
+        dot_x_pos, dot_y_pos = DotPositions(grid, w, h, ds)
+        self.cx = np.array(dot_x_pos, dtype=np.intp)
+        self.cy = np.broadcast_to(np.array(dot_y_pos, dtype=np.intp), (w, h))
+
+        # pixels set by pygame.draw.circle of radius dr around (dr, dr)
+        stamp = pygame.Surface((2 * dr + 1, 2 * dr + 1), 0, 32)
+        stamp.fill((0, 0, 0))
+        pygame.draw.circle(stamp, (255, 255, 255), (dr, dr), dr, 0)
+        dx, dy = np.nonzero(pygame.surfarray.array2d(stamp))
+        self.stamp = list(zip((dx - dr).tolist(), (dy - dr).tolist()))
+        width, height = window.get_size()
+        self.inside = ((self.cx + dx.min() - dr >= 0) & (self.cx + dx.max() - dr < width) &
+                       (self.cy + dy.min() - dr >= 0) & (self.cy + dy.max() - dr < height))
+
+        self.shown = np.full((w, h), -1, dtype=np.int64)     # color code on screen, -1 unknown
+        self.direct = window.get_bytesize() in (2, 4)
+        self.shifts = window.get_shifts()[:3]
+        self.losses = window.get_losses()[:3]
+
+    # Forget what is on screen under rect (the whole window by default), so
+    #       the next Draw() repaints those dots, for when something was drawn over them
+    def Invalidate(self, rect=None):
+        if rect is None:
+            self.shown.fill(-1)
+            return
+        rect = pygame.Rect(rect)
+        dr = self.dr
+        hit = ((self.cx + dr >= rect.left) & (self.cx - dr < rect.right) &
+               (self.cy + dr >= rect.top) & (self.cy - dr < rect.bottom))
+        self.shown[hit] = -1
+
+    # Colors of the whole board as 0xRRGGBB codes, black where no node is drawn
+    def Colors(self, engine):
+        x_pos, y_pos, iD = engine.DrawnNodes()
+        red = np.clip(engine.b_ext[x_pos, y_pos], 0, 255).astype(np.int64)
+        green = np.clip(iD * 7, 0, 255).astype(np.int64)
+        codes = np.zeros((self.w, self.h), dtype=np.int64)
+        codes[x_pos, y_pos] = (red << 16) | (green << 8) | green
+        return codes
+
+    def Draw(self, engine):
+        codes = self.Colors(engine)
+        changed = codes != self.shown
+        self.shown[changed] = codes[changed]
+        x, y = np.nonzero(changed)
+        if not len(x):
+            return []
+        code = codes[x, y]
+        cx, cy = self.cx[x, y], self.cy[x, y]
+
+        stamped = self.inside[x, y] if self.direct else np.zeros(len(x), dtype=bool)
+        if stamped.any():
+            sx, sy, sc = cx[stamped], cy[stamped], code[stamped]
+            rgb = (sc >> 16, (sc >> 8) & 255, sc & 255)
+            mapped = sum((c >> loss) << shift for c, loss, shift in zip(rgb, self.losses, self.shifts))
+            pixels = pygame.surfarray.pixels2d(self.window)
+            mapped = mapped.astype(pixels.dtype)
+            for dx, dy in self.stamp:
+                pixels[sx + dx, sy + dy] = mapped
+            del pixels
+        for px, py, c in zip(cx[~stamped].tolist(), cy[~stamped].tolist(), code[~stamped].tolist()):
+            pygame.draw.circle(self.window, (c >> 16, (c >> 8) & 255, c & 255), (px, py), self.dr, 0)
+
+        if len(x) > self.DIRTY_FULL_FRACTION * self.w * self.h:
+            return [self.window.get_rect()]
+        size = 2 * self.dr + 1
+        return [pygame.Rect(px - self.dr, py - self.dr, size, size) for px, py in zip(cx.tolist(), cy.tolist())]
@@ -0,0 +1,148 @@
+
+#                                                       ABOUT
+
+# Replay viewer
+#       plays back a recording made with record.Recorder at display rate,
+#       without stepping an engine
+
+# python -m gameoflight.replay run.golrec
+#       space       play / pause
+#       left right  one frame back / forward
+#       up down     double / halve the playback speed
+#       home end    first / last frame
+#       mouse       click or drag along the bar at the bottom to scrub
+#       escape      quit
+
+import argparse
+import sys
+
+import numpy as np
+import pygame
+
+from .grid import WindowSize
+from .record import Recording
+from .render import ArrayRenderer
+
+
+BAR_HEIGHT = 12             # scrub bar [px]
+MAX_SPEED = 256             # frames per display frame
+
+
+# One recorded frame, shaped like an engine as far as the renderers care
+class ReplayFrame(object):
+
+    def __init__(self, recording):
+        self.w, self.h, self.grid, self.psr = recording.w, recording.h, recording.grid, recording.psr
+        xs, ys = slice(self.psr, self.w - self.psr), slice(self.psr, self.h - self.psr)
+        x_pos, y_pos = np.mgrid[xs, ys]
+        self.x_pos, self.y_pos = x_pos.ravel(), y_pos.ravel()
+        self.iD = np.zeros((self.w, self.h))
+        self.b_ext = np.zeros((self.w, self.h))
+
+    def Load(self, recording, i):
+        self.iD, self.b_ext = recording.Frame(i)
+
+    def DrawnNodes(self):
+        return self.x_pos, self.y_pos, self.iD[self.x_pos, self.y_pos]
+
+
+class ReplayViewer(object):
+
+    def __init__(self, recording, ds=28, dr=12, fps=60):
+        self.recording = recording
+        self.fps = fps
+        self.frame = ReplayFrame(recording)
+        width, height = WindowSize(recording.grid, recording.w, recording.h, ds)
+        self.window = pygame.display.set_mode((width, height + BAR_HEIGHT))
+        pygame.display.set_caption("Game of Light replay - %s" % recording.path)
+        self.renderer = ArrayRenderer(self.window, recording.w, recording.h, recording.grid, ds, dr)
+        self.font = pygame.font.SysFont("Arial", 20)
+        self.position = 0
+        self.speed = 1
+        self.playing = True
+
+    def Seek(self, i):
+        self.position = min(max(i, 0), len(self.recording) - 1)
+
+    def _Scrub(self, x):
+        self.Seek(int(x * len(self.recording) / float(self.window.get_width())))
+
+    def Draw(self):
+        self.frame.Load(self.recording, self.position)
+        width, height = self.window.get_size()
+
+        # status text under the dots, only the dots it covers are redrawn
+        text = self.font.render("frame %d / %d   step %d   %dx%s" % (
+            self.position + 1, len(self.recording), self.recording.steps[self.position], self.speed,
+            '' if self.playing else '   paused'), 1, (100, 30, 10))
+        textRect = pygame.Rect(0, 0, width, text.get_height() + 20)
+        self.window.fill((0, 0, 0), textRect)
+        self.window.blit(text, (10, 10))
+        self.renderer.Invalidate(textRect)
+        rects = [textRect] + self.renderer.Draw(self.frame)
+
+        bar = pygame.Rect(0, height - BAR_HEIGHT, width, BAR_HEIGHT)
+        done = int(width * (self.position + 1) / float(len(self.recording)))
+        pygame.draw.rect(self.window, (40, 40, 40), bar)
+        pygame.draw.rect(self.window, (100, 30, 10), (0, bar.top, done, BAR_HEIGHT))
+        pygame.display.update(rects + [bar])
+
+    # Returns False once the viewer should close
+    def HandleEvents(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    return False
+                elif event.key == pygame.K_SPACE:
+                    self.playing = not self.playing
+                elif event.key == pygame.K_RIGHT:
+                    self.Seek(self.position + 1)
+                elif event.key == pygame.K_LEFT:
+                    self.Seek(self.position - 1)
+                elif event.key == pygame.K_UP:
+                    self.speed = min(2 * self.speed, MAX_SPEED)
+                elif event.key == pygame.K_DOWN:
+                    self.speed = max(self.speed // 2, 1)
+                elif event.key == pygame.K_HOME:
+                    self.Seek(0)
+                elif event.key == pygame.K_END:
+                    self.Seek(len(self.recording) - 1)
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                self._Scrub(event.pos[0])
+            elif event.type == pygame.MOUSEMOTION and event.buttons[0]:
+                self._Scrub(event.pos[0])
+        return True
+
+    def Run(self):
+        clock = pygame.time.Clock()
+        while self.HandleEvents():
+            if self.playing:
+                if self.position == len(self.recording) - 1:
+                    self.playing = False
+                self.Seek(self.position + self.speed)
+            self.Draw()
+            clock.tick(self.fps)
+
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='gameoflight.replay', description='Play back a Game of Light recording')
+    parser.add_argument('path')
+    parser.add_argument('--ds', type=int, default=28, help='dot spacing [px]')
+    parser.add_argument('--dr', type=int, default=12, help='dot radius [px]')
+    parser.add_argument('--fps', type=int, default=60)
+    args = parser.parse_args(argv)
+
+    recording = Recording(args.path)
+    if not len(recording):
+        print("%s has no frames" % args.path)
+        return 1
+    pygame.init()
+    ReplayViewer(recording, args.ds, args.dr, args.fps).Run()
+    pygame.quit()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
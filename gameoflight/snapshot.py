@@ -0,0 +1,227 @@
+
+#                                                       ABOUT
+
+# Snapshots
+#       the whole state of an engine in one binary file that a run can be
+#       resumed from, bit for bit, at any step
+
+# Layout
+#       SNAPSHOT_MAGIC, the JSON header length as a little endian uint64, the
+#       JSON header (board, tunables, seed, and name / dtype / shape / offset of
+#       every array), then the raw arrays in C order, each starting on a
+#       SNAPSHOT_ALIGN byte boundary so they can be memory mapped in place
+
+# Resume(path) builds a fresh engine from a snapshot, Restore(engine, path)
+#       loads one into an existing engine of the same board and MappedEngine(path)
+#       steps the arrays straight out of the file without reading it first
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from .engine import ArrayEngine, GraphEngine, STATE_FIELDS, TUNABLES
+from .fixed import FixedEngine
+from .packed import PackedEngine
+
+
+#                                                       CONSTANTS
+
+SNAPSHOT_MAGIC = b'GOLSNAP\x01'
+SNAPSHOT_ALIGN = 64
+
+# Arrays saved in a snapshot, state holds STATE_FIELDS stacked
+SNAPSHOT_ARRAYS = ('state', 'b_ext', 'active_nodes', 'pSensVariation', 'idVariation')
+
+
+# FixedEngine keeps integer codes a snapshot has no place for, and
+#       GraphEngine a topology it couldn't be resumed without
+def _CheckEngine(engine):
+    if isinstance(engine, FixedEngine):
+        raise ValueError("snapshots don't support FixedEngine")
+    if isinstance(engine, GraphEngine):
+        raise ValueError("snapshots don't support GraphEngine")
+
+
+# State of any engine as [x][y] arrays, PackedEngine scatters its packed fields
+def _Arrays(engine):
+    arrays = dict((name, getattr(engine, name)) for name in SNAPSHOT_ARRAYS[1:])
+    if isinstance(engine, PackedEngine):
+        arrays['state'] = np.stack([engine.Dense(name) for name in STATE_FIELDS])
+    else:
+        arrays['state'] = engine.state
+    return arrays
+
+
+# Tunables are plain numbers, or lists with their shape for per-member ensemble values
+def _Tunable(value):
+    if isinstance(value, np.ndarray):
+        return {'shape': list(value.shape), 'values': value.ravel().tolist()}
+    return value
+
+
+def _Untunable(value):
+    if isinstance(value, dict):
+        return np.array(value['values'], dtype=float).reshape(value['shape'])
+    return value
+
+
+def Save(engine, path, steps=None):
+    _CheckEngine(engine)
+    arrays = _Arrays(engine)
+    header = {'w': engine.w, 'h': engine.h, 'grid': engine.grid, 'psr': engine.psr,
+              'bFn': engine.bFn, 'seed': engine.seed, 'steps': steps,
+              'brightnessMode': getattr(engine, 'brightnessMode', None),
+              'tunables': dict((name, _Tunable(getattr(engine, name))) for name in TUNABLES),
+              'arrays': []}
+
+    # offsets are relative to the end of the padded header, which isn't known yet
+    offset = 0
+    for name in SNAPSHOT_ARRAYS:
+        a = arrays[name]
+        header['arrays'].append({'name': name, 'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset})
+        offset += -(-a.nbytes // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+    text = json.dumps(header).encode('utf-8')
+    start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(text)) // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+    # written next to path and moved over it, so an engine mapped from path
+    #       (MappedEngine) keeps reading its file until the new one is complete
+    fd, temp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(np.uint64(len(text)).tobytes())
+            f.write(text)
+            for entry in header['arrays']:
+                f.seek(start + entry['offset'])
+                f.write(np.ascontiguousarray(arrays[entry['name']]).tobytes())
+            f.truncate(start + offset)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+    # an engine writing back to path would otherwise go on writing to the old file
+    if (isinstance(engine, MappedEngine) and engine.snapshot.mmap == 'r+' and
+            os.path.abspath(engine.snapshot.path) == os.path.abspath(path)):
+        engine.Remap()
+
+
+class Snapshot(object):
+
+    # mmap: None reads the arrays into memory, otherwise the np.memmap mode
+    #       ('r' read only, 'c' copy on write, 'r+' writes back to the file)
+    def __init__(self, path, mmap='r'):
+        self.path = path
+        self.mmap = mmap
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError("%s is not a Game of Light snapshot" % path)
+            length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            self.header = json.loads(f.read(length).decode('utf-8'))
+            start = -(-(len(SNAPSHOT_MAGIC) + 8 + length) // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+            self.arrays = {}
+            for entry in self.header['arrays']:
+                dtype, shape = np.dtype(entry['dtype']), tuple(entry['shape'])
+                if mmap is None:
+                    f.seek(start + entry['offset'])
+                    a = np.fromfile(f, dtype, int(np.prod(shape))).reshape(shape)
+                else:
+                    a = np.memmap(path, dtype, mmap, start + entry['offset'], shape)
+                self.arrays[entry['name']] = a
+
+        for key in ('w', 'h', 'grid', 'psr', 'bFn', 'seed', 'steps', 'brightnessMode'):
+            setattr(self, key, self.header[key])
+        self.tunables = dict((name, _Untunable(value)) for name, value in self.header['tunables'].items())
+
+    # Leading ensemble axes of the saved state, () for a single board
+    def BatchShape(self):
+        return tuple(self.arrays['state'].shape[1:-2])
+
+
+def _Open(snapshot, mmap='r'):
+    return snapshot if isinstance(snapshot, Snapshot) else Snapshot(snapshot, mmap)
+
+
+# Load a snapshot into engine, which must have the same board
+def Restore(engine, snapshot):
+    _CheckEngine(engine)
+    snapshot = _Open(snapshot)
+    board = (engine.w, engine.h, engine.grid, engine.psr)
+    if board != (snapshot.w, snapshot.h, snapshot.grid, snapshot.psr):
+        raise ValueError("snapshot board %r doesn't match the engine's %r" %
+                         ((snapshot.w, snapshot.h, snapshot.grid, snapshot.psr), board))
+    if snapshot.BatchShape() != getattr(engine, 'batchShape', ()):
+        raise ValueError("snapshot of %r members doesn't match the engine's %r" %
+                         (snapshot.BatchShape(), getattr(engine, 'batchShape', ())))
+
+    for name, value in snapshot.tunables.items():
+        setattr(engine, name, value)
+    engine.seed = snapshot.seed
+    if snapshot.brightnessMode is not None and hasattr(engine, 'SetBrightnessMode'):
+        engine.brightnessMode = snapshot.brightnessMode
+    engine.SetBrightnessFn(snapshot.bFn)
+    if hasattr(engine, 'SyncMembers'):
+        engine.SyncMembers()      # ensembles label Summary() rows by their member dicts
+
+    arrays = snapshot.arrays
+    for name in SNAPSHOT_ARRAYS[1:]:
+        getattr(engine, name)[...] = arrays[name]
+    if isinstance(engine, PackedEngine):
+        # packed engines rebuild their node list from the active map first
+        engine._Pack(np.array(arrays['active_nodes']))
+        live = slice(1, engine.n + 1)
+        for name, field in zip(STATE_FIELDS, arrays['state']):
+            getattr(engine, name)[live] = field[engine.x_pos[live], engine.y_pos[live]]
+    else:
+        engine.state[...] = arrays['state']
+    return engine
+
+
+# Fresh engine of class cls resumed from a snapshot
+def Resume(snapshot, cls=ArrayEngine):
+    snapshot = _Open(snapshot)
+    engine = cls(snapshot.w, snapshot.h, snapshot.grid, snapshot.psr, snapshot.bFn, seed=snapshot.seed)
+    return Restore(engine, snapshot)
+
+
+#                                                       Engine
+
+class MappedEngine(ArrayEngine):
+
+    # ArrayEngine stepping the snapshot's arrays in place, so opening it costs
+    #       nothing however large the board, with mode 'c' steps stay in memory,
+    #       with 'r+' they are written back to the file
+    def __init__(self, path, mode='c'):
+        snapshot = Snapshot(path, mode)
+        if snapshot.BatchShape():
+            raise ValueError("ensemble snapshots resume through Restore() into an EnsembleEngine")
+        self.snapshot = snapshot
+        self.w, self.h, self.grid, self.psr = snapshot.w, snapshot.h, snapshot.grid, snapshot.psr
+        self.seed = snapshot.seed
+        self.batchShape = snapshot.BatchShape()
+        self.interior = (slice(self.psr, self.w - self.psr), slice(self.psr, self.h - self.psr))
+        for name, value in snapshot.tunables.items():
+            setattr(self, name, value)
+        if snapshot.brightnessMode is not None:
+            self.brightnessMode = snapshot.brightnessMode
+
+        for name in SNAPSHOT_ARRAYS:
+            setattr(self, name, snapshot.arrays[name])
+        self.b, self.vg, self.rqi, self.vd, self.iD = self.state
+        self.SetBrightnessFn(snapshot.bFn)
+
+    # Map the arrays of the snapshot's file again, once Save() has replaced it
+    def Remap(self):
+        self.snapshot = Snapshot(self.snapshot.path, self.snapshot.mmap)
+        for name in SNAPSHOT_ARRAYS:
+            setattr(self, name, self.snapshot.arrays[name])
+        self.b, self.vg, self.rqi, self.vd, self.iD = self.state
+
+    # Write the stepped state back to the file (mode 'r+' only)
+    def Flush(self):
+        for name in SNAPSHOT_ARRAYS:
+            getattr(self, name).flush()
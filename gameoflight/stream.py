@@ -0,0 +1,374 @@
+
+#                                                       ABOUT
+
+# Frame streaming server
+#       serves the LED field of a headless run over a local TCP or Unix socket,
+#       so displays and dashboards can follow it without pygame on this box,
+#       and takes flash light and toggle commands back from them
+
+# Publish() is all the stepping thread does: it applies the commands that came
+#       in since the last step, quantizes iD to bytes and swaps the frame in
+#       under a lock. Every client has its own sender thread that always sends
+#       the newest frame, as a delta against the last one that client got, so a
+#       slow client skips frames instead of holding up Step()
+
+# Server to client, messages of MESSAGE_HEADER (kind, payload bytes, step)
+#       HELLO       JSON header: w, h, grid, psr, quantum
+#       KEYFRAME    w x h brightness levels as bytes, [x][y] order
+#       DELTA       count as uint32, count uint32 indices into the [x][y]
+#                   board and the count new levels as bytes
+#       a client gets a keyframe first, every keyframeEvery frames sent, and
+#       whenever a delta would be no smaller than one
+# Client to server, one JSON object per line
+#       {"cmd": "flash", "x": 20, "y": 20, "r": 2, "brightness": 140}
+#       {"cmd": "clear"}
+#       {"cmd": "toggle", "x": 20, "y": 20, "r": 0}
+
+# python -m gameoflight.stream --port 7070
+# python -m gameoflight.stream --unix /tmp/gol.sock --steps 0 --rate 60
+
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .engine import ArrayEngine, DenseField
+from .grid import HEX, SQUARE, B_3, B_FNS
+from .record import ID_QUANTUM
+
+
+#                                                       CONSTANTS
+
+STREAM_HOST = '127.0.0.1'
+STREAM_PORT = 7070
+
+HELLO = b'H'
+KEYFRAME = b'K'
+DELTA = b'D'
+
+MESSAGE_HEADER = struct.Struct('<cIQ')
+
+KEYFRAME_EVERY = 256        # frames sent to a client between keyframes
+MAX_CLIENTS = 16
+COMMAND_QUEUE = 1024        # commands waiting for the next step, later ones are dropped
+MAX_COMMAND_LINE = 4096
+MAX_TOOL_RADIUS = 18        # FLR_MAX of the window front end
+MAX_BRIGHTNESS = 250        # FLB_MAX of the window front end
+
+
+# iD as brightness levels of ID_QUANTUM, the LED color steps of render.LedColor
+def Levels(engine):
+    return np.clip(DenseField(engine, 'iD') * (1 / ID_QUANTUM), 0, 255).astype(np.uint8)
+
+
+# A client command checked and cleaned up for ApplyCommands, None if it isn't
+#       one: x and y must be whole numbers on the w x h board, r and brightness
+#       are clamped to what the window front end allows
+def CheckCommand(command, w, h):
+    if not isinstance(command, dict):
+        return None
+    cmd = command.get('cmd')
+    if cmd == 'clear':
+        return {'cmd': cmd}
+    if cmd not in ('flash', 'toggle'):
+        return None
+    x, y, r = command.get('x'), command.get('y'), command.get('r', 2 if cmd == 'flash' else 0)
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in (x, y, r)):
+        return None
+    if not (0 <= x < w and 0 <= y < h):
+        return None
+    checked = {'cmd': cmd, 'x': x, 'y': y, 'r': min(max(r, 0), MAX_TOOL_RADIUS)}
+    if cmd == 'flash':
+        brightness = command.get('brightness', 140)
+        if not isinstance(brightness, (int, float)) or isinstance(brightness, bool) or brightness != brightness:
+            return None
+        checked['brightness'] = min(max(float(brightness), 0.0), MAX_BRIGHTNESS)
+    return checked
+
+
+def _Message(kind, step, payload):
+    return MESSAGE_HEADER.pack(kind, len(payload), step) + payload
+
+
+def _Socket(address):
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+#                                                       Server
+
+class FrameServer(object):
+
+    # address is (host, port) for TCP or a path for a Unix socket
+    def __init__(self, engine, address=(STREAM_HOST, STREAM_PORT), keyframeEvery=KEYFRAME_EVERY):
+        self.address = address
+        self.keyframeEvery = keyframeEvery
+        self.header = {'w': engine.w, 'h': engine.h, 'grid': engine.grid, 'psr': engine.psr, 'quantum': ID_QUANTUM}
+        self.commands = queue.Queue(COMMAND_QUEUE)
+        self.condition = threading.Condition()
+        self.frame = None           # (frame number, step, levels), levels never changed once published
+        self.frames = 0
+        self.clients = []
+        self.closed = False
+        self.dropped = 0            # commands dropped with the queue full
+        self.rejected = 0           # lines that weren't valid commands
+
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+        self.listener = _Socket(address)
+        if not isinstance(address, str):
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(MAX_CLIENTS)
+        if not isinstance(address, str):
+            self.address = self.listener.getsockname()
+        self.acceptor = threading.Thread(target=self._Accept)
+        self.acceptor.daemon = True
+        self.acceptor.start()
+
+    # Called by the stepping thread after each step it wants streamed
+    def Publish(self, engine, step):
+        self.ApplyCommands(engine)
+        levels = Levels(engine)
+        with self.condition:
+            self.frames += 1
+            self.frame = (self.frames, step, levels)
+            self.condition.notify_all()
+
+    # Apply the commands clients sent since the last call, between steps
+    #       they were checked by CheckCommand on the way in
+    def ApplyCommands(self, engine):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            cmd = command['cmd']
+            if cmd == 'flash':
+                engine.FlashLight(command['x'], command['y'], command['r'], command['brightness'])
+            elif cmd == 'clear':
+                engine.ClearFlashLight()
+            elif cmd == 'toggle':
+                engine.ToggleNodes(command['x'], command['y'], command['r'])
+
+    def Clients(self):
+        with self.condition:
+            return len(self.clients)
+
+    def Close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            clients = list(self.clients)
+        self.listener.close()
+        for connection in clients:
+            _Shutdown(connection)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def _Accept(self):
+        while not self.closed:
+            try:
+                connection, peer = self.listener.accept()
+            except OSError:
+                return
+            with self.condition:
+                if len(self.clients) >= MAX_CLIENTS:
+                    connection.close()
+                    continue
+                self.clients.append(connection)
+            for target in (self._Send, self._Receive):
+                thread = threading.Thread(target=target, args=(connection,))
+                thread.daemon = True
+                thread.start()
+
+    def _Drop(self, connection):
+        with self.condition:
+            if connection in self.clients:
+                self.clients.remove(connection)
+                self.condition.notify_all()
+        _Shutdown(connection)
+
+    # Newest frame to one client, only ever blocking on that client's socket
+    def _Send(self, connection):
+        seen, last, sent = 0, None, 0
+        try:
+            connection.sendall(_Message(HELLO, 0, json.dumps(self.header).encode('utf-8')))
+            while True:
+                with self.condition:
+                    while not self.closed and connection in self.clients and (self.frame is None or
+                                                                              self.frame[0] == seen):
+                        self.condition.wait()
+                    if self.closed or connection not in self.clients:
+                        return
+                    seen, step, levels = self.frame
+                flat = levels.ravel()
+                if last is not None and sent % self.keyframeEvery:
+                    changed = np.flatnonzero(flat != last).astype('<u4')
+                    if 5 * len(changed) + 4 < len(flat):
+                        payload = np.uint32(len(changed)).astype('<u4').tobytes() + changed.tobytes() + \
+                            flat[changed].tobytes()
+                        connection.sendall(_Message(DELTA, step, payload))
+                        last, sent = flat, sent + 1
+                        continue
+                connection.sendall(_Message(KEYFRAME, step, flat.tobytes()))
+                last, sent = flat, sent + 1
+        except OSError:
+            pass
+        finally:
+            self._Drop(connection)
+
+    # Commands from one client onto the shared queue, malformed lines and
+    #       invalid commands are skipped and counted in rejected
+    def _Receive(self, connection):
+        buffered = b''
+        try:
+            while True:
+                data = connection.recv(MAX_COMMAND_LINE)
+                if not data:
+                    return
+                buffered += data
+                *lines, buffered = buffered.split(b'\n')
+                if len(buffered) > MAX_COMMAND_LINE:
+                    return
+                for line in lines:
+                    try:
+                        command = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        command = None
+                    command = CheckCommand(command, self.header['w'], self.header['h'])
+                    if command is None:
+                        self.rejected += 1
+                        continue
+                    try:
+                        self.commands.put_nowait(command)
+                    except queue.Full:
+                        self.dropped += 1
+        except OSError:
+            pass
+        finally:
+            self._Drop(connection)
+
+
+def _Shutdown(connection):
+    try:
+        connection.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    connection.close()
+
+
+#                                                       Client
+
+class FrameClient(object):
+
+    def __init__(self, address=(STREAM_HOST, STREAM_PORT), timeout=None):
+        self.socket = _Socket(address)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        kind, step, payload = self._Read()
+        if kind != HELLO:
+            raise ValueError("not a Game of Light frame stream")
+        self.header = json.loads(payload.decode('utf-8'))
+        self.w, self.h = self.header['w'], self.header['h']
+        self.levels = None
+        self.step = None
+
+    def _ReadExactly(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.socket.recv(n - len(data))
+            if not chunk:
+                raise EOFError("frame stream closed")
+            data += chunk
+        return data
+
+    def _Read(self):
+        kind, size, step = MESSAGE_HEADER.unpack(self._ReadExactly(MESSAGE_HEADER.size))
+        return kind, step, self._ReadExactly(size)
+
+    # Next frame as (step, [x][y] brightness levels), iD is about levels * quantum
+    def Receive(self):
+        kind, step, payload = self._Read()
+        if kind == KEYFRAME:
+            self.levels = np.frombuffer(payload, np.uint8).reshape(self.w, self.h).copy()
+        elif kind == DELTA:
+            count = int(np.frombuffer(payload[:4], '<u4')[0])
+            index = np.frombuffer(payload[4:4 + 4 * count], '<u4')
+            self.levels.ravel()[index] = np.frombuffer(payload[4 + 4 * count:], np.uint8)
+        self.step = step
+        return step, self.levels
+
+    def Send(self, **command):
+        self.socket.sendall(json.dumps(command).encode('utf-8') + b'\n')
+
+    def FlashLight(self, x, y, r, brightness):
+        self.Send(cmd='flash', x=x, y=y, r=r, brightness=brightness)
+
+    def ClearFlashLight(self):
+        self.Send(cmd='clear')
+
+    def ToggleNodes(self, x, y, r=0):
+        self.Send(cmd='toggle', x=x, y=y, r=r)
+
+    def Close(self):
+        _Shutdown(self.socket)
+
+
+#                                                       Command line
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='gameoflight.stream', description='Stream a headless Game of Light run')
+    parser.add_argument('--host', default=STREAM_HOST)
+    parser.add_argument('--port', type=int, default=STREAM_PORT)
+    parser.add_argument('--unix', default=None, help='Unix socket path to serve on instead of TCP')
+    parser.add_argument('--steps', type=int, default=0, help='steps to run, 0 runs until interrupted')
+    parser.add_argument('--rate', type=float, default=0, help='max steps per second, 0 steps flat out')
+    parser.add_argument('--grid', choices=('hex', 'square'), default='hex')
+    parser.add_argument('--width', type=int, default=41)
+    parser.add_argument('--height', type=int, default=41)
+    parser.add_argument('--psr', type=int, default=1)
+    parser.add_argument('--bfn', choices=B_FNS, default=B_3)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--keyframe-every', type=int, default=KEYFRAME_EVERY)
+    args = parser.parse_args(argv)
+
+    engine = ArrayEngine(args.width, args.height, HEX if args.grid == 'hex' else SQUARE, args.psr, args.bfn, args.seed)
+    server = FrameServer(engine, args.unix or (args.host, args.port), args.keyframe_every)
+    print("streaming on %s (seed %d)" % (server.address, engine.seed))
+    step, due = 0, time.time()
+    try:
+        while not args.steps or step < args.steps:
+            if args.rate:
+                due += 1.0 / args.rate
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    due = time.time()
+            engine.Step()
+            step += 1
+            server.Publish(engine, step)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.Close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,184 @@
+
+#                                                       ABOUT
+
+# Batched parameter sweeps
+#       runs many independent grids at once, stacked along a leading ensemble
+#       axis, each member with its own tunables and brightness function
+
+# python -m gameoflight.sweep --sensitivity 0.02:0.12:0.005 --bfn B_3 B_6
+
+import argparse
+import itertools
+import sys
+
+import numpy as np
+
+from .circuit import VG_STEP_SCALE, VD_STEP_SCALE, P_SENSITIVITY, P_VREF_LOW, P_VREF_HIGH
+from .convolve import Convolver
+from .cycles import CycleDetector
+from .engine import ArrayEngine
+from .grid import HEX, SQUARE, B_3, B_FNS, Stencil, StencilReach
+from .headless import HeadlessRunner
+from .metrics import LIT_CURRENT, METRICS, OnlineMetrics, MetricColumn, RankRows
+
+
+#                                                       CONSTANTS
+
+# Tunables a sweep member may set, with their defaults
+SWEEP_DEFAULTS = (('pSensitivity', P_SENSITIVITY),
+                  ('pVRefLow', P_VREF_LOW),
+                  ('pVRefHigh', P_VREF_HIGH),
+                  ('vgStepScale', VG_STEP_SCALE),
+                  ('vdStepScale', VD_STEP_SCALE),
+                  ('bFn', B_3))
+
+SWEEP_PARAMS = tuple(name for name, default in SWEEP_DEFAULTS)
+
+
+# Every combination of the given parameter values as a list of member dicts
+#       SweepGrid(pSensitivity=[0.02, 0.08], bFn=[B_3, B_6]) gives 4 members
+def SweepGrid(**axes):
+    for name in axes:
+        if name not in SWEEP_PARAMS:
+            raise ValueError("%s can't be swept, pick from %s" % (name, ', '.join(SWEEP_PARAMS)))
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*[axes[name] for name in names])]
+
+
+#                                                       Engine
+
+class EnsembleEngine(ArrayEngine):
+
+    detector = None     # cycles.CycleDetector of an early stopping sweep, adds periods to Summary()
+    metrics = None      # metrics.OnlineMetrics of a measured sweep, adds its METRICS to Summary()
+
+    # members is a list of dicts of tunables, missing ones take the defaults
+    #       all members share the board (size, grid, PSR, active nodes, variation)
+    def __init__(self, members, w=41, h=41, grid=HEX, psr=1, seed=None):
+        self.members = [dict(SWEEP_DEFAULTS, **member) for member in members]
+        self.batchShape = (len(self.members),)
+        ArrayEngine.__init__(self, w, h, grid, psr, [m['bFn'] for m in self.members], seed)
+
+        # per-member tunables broadcast against the [n][x][y] state
+        for name in SWEEP_PARAMS:
+            if name != 'bFn':
+                setattr(self, name, np.array([m[name] for m in self.members], dtype=float).reshape(-1, 1, 1))
+
+    # Rebuild the member dicts from the per-member tunables and brightness
+    #       functions, after they were set as a whole (see snapshot.Restore)
+    def SyncMembers(self):
+        n = len(self.members)
+        for name in SWEEP_PARAMS:
+            if name == 'bFn':
+                values = self.bFn
+            else:
+                values = np.broadcast_to(np.asarray(getattr(self, name), dtype=float).reshape(-1), (n,))
+                values = [float(v) for v in values]
+            for member, value in zip(self.members, values):
+                member[name] = value
+
+    # bFn is one brightness function per member, members sharing one are summed together
+    def SetBrightnessFn(self, bFn):
+        self.bFn = list(bFn)
+        self.groups = []
+        for name in sorted(set(self.bFn)):
+            stencil = Stencil(name, self.grid, self.psr)
+            if StencilReach(stencil) > self.psr:
+                raise ValueError("%s needs PSR >= %d" % (name, StencilReach(stencil)))
+            index = np.array([k for k, f in enumerate(self.bFn) if f == name])
+            self.groups.append((index, Convolver(stencil, self.psr, self.brightnessMode)))
+
+    def BrightnessSum(self, xs, ys, iD=None):
+        if iD is None:
+            iD = self.iD
+        if len(self.groups) == 1:
+            return self.groups[0][1].Sum(iD, xs, ys)
+        light = np.empty(self.batchShape + (xs.stop - xs.start, ys.stop - ys.start))
+        for index, convolver in self.groups:
+            light[index] = convolver.Sum(iD[index], xs, ys)
+        return light
+
+    # Per-member summary of the LED field
+    def Summary(self):
+        active = self.active_nodes
+        iD = self.iD[:, active]
+        meanCurrent = iD.mean(axis=1)
+        litFraction = (iD > LIT_CURRENT).mean(axis=1)
+        rows = [dict(member, meanCurrent=float(m), litFraction=float(f))
+                for member, m, f in zip(self.members, meanCurrent, litFraction)]
+        if self.detector is not None:
+            for row, period, transient in zip(rows, self.detector.Periods(), self.detector.Transients()):
+                row.update(period=period, transient=transient)
+        if self.metrics is not None:
+            for row, measured in zip(rows, self.metrics.Summary()):
+                row.update(measured)
+        return rows
+
+
+# Run every member for steps from power up with the flash light seeding the
+#       grid center for flashSteps, returns the finished engine
+# With stopEarly the sweep ends as soon as every member has settled or
+#       started repeating, and Summary() reports each one's period and transient
+# With measure Summary() also reports each member's online metrics
+def Sweep(members, steps, w=41, h=41, grid=HEX, psr=1, seed=None, flashSteps=100, stopEarly=False, measure=False):
+    engine = EnsembleEngine(members, w, h, grid, psr, seed)
+    if stopEarly:
+        engine.detector = CycleDetector()
+    if measure:
+        engine.metrics = OnlineMetrics()
+    HeadlessRunner(engine, detector=engine.detector, metrics=engine.metrics).Run(steps, flashSteps=flashSteps)
+    return engine
+
+
+#                                                       Command line
+
+# "start:stop:step" or a plain value
+def ParseRange(text):
+    parts = [float(p) for p in text.split(':')]
+    if len(parts) == 1:
+        return parts
+    start, stop, step = parts
+    return list(np.round(np.arange(start, stop + step / 2, step), 10))
+
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='gameoflight.sweep', description='Batched Game of Light parameter sweep')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--grid', choices=('hex', 'square'), default='hex')
+    parser.add_argument('--width', type=int, default=41)
+    parser.add_argument('--height', type=int, default=41)
+    parser.add_argument('--psr', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--flash-steps', type=int, default=100)
+    parser.add_argument('--stop-early', action='store_true', help='stop once every member settles or repeats')
+    parser.add_argument('--metrics', action='store_true', help='measure online metrics of every member')
+    parser.add_argument('--rank', choices=METRICS, default=None, help='sort members by a metric, highest first')
+    parser.add_argument('--bfn', nargs='+', choices=B_FNS, default=[B_3])
+    parser.add_argument('--sensitivity', type=ParseRange, default=[P_SENSITIVITY])
+    parser.add_argument('--vref-low', type=ParseRange, default=[P_VREF_LOW])
+    parser.add_argument('--vref-high', type=ParseRange, default=[P_VREF_HIGH])
+    args = parser.parse_args(argv)
+
+    members = SweepGrid(bFn=args.bfn, pSensitivity=args.sensitivity,
+                        pVRefLow=args.vref_low, pVRefHigh=args.vref_high)
+    measure = args.metrics or args.rank is not None
+    engine = Sweep(members, args.steps, args.width, args.height,
+                   HEX if args.grid == 'hex' else SQUARE, args.psr, args.seed, args.flash_steps, args.stop_early,
+                   measure)
+    rows = engine.Summary()
+    if args.rank:
+        rows = RankRows(rows, args.rank)
+    names = METRICS if measure else ()
+    print("%-9s %12s %9s %9s %12s %11s %7s %9s" % ('bFn', 'sensitivity', 'vRefLow', 'vRefHigh',
+                                                  'meanCurrent', 'litFraction', 'period', 'transient') +
+          ''.join(" %15s" % name for name in names))
+    for row in rows:
+        print("%-9s %12.4f %9.3f %9.3f %12.4f %11.3f %7s %9s" % (row['bFn'], row['pSensitivity'], row['pVRefLow'],
+                                                                 row['pVRefHigh'], row['meanCurrent'], row['litFraction'],
+                                                                 row.get('period') or '-', row.get('transient') or '-') +
+              ''.join(MetricColumn(row.get(name)) for name in names))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,117 @@
+
+#                                                       ABOUT
+
+# Per phase timing
+#       engines and front ends wrap each stage of a frame in timer.Phase(name)
+#       and the timer keeps the last window durations of every phase, from which
+#       it reports rolling percentiles, as HUD lines or dumped to CSV / JSON
+
+# Engines default to NULL_TIMER, whose phases cost next to nothing,
+#       set engine.timer = PhaseTimer() to start measuring
+
+import csv
+import collections
+import json
+import time
+
+import numpy as np
+
+
+#                                                       CONSTANTS
+
+# Phases in frame order, others may be added freely
+BRIGHTNESS = 'brightness'   # brightness sum of the sensed LEDs
+CIRCUIT = 'circuit'         # VG, RQi and VD update
+CURRENT = 'current'         # Id_at_Vd pass
+DRAW = 'draw'               # circle drawing
+SETTINGS = 'settings'       # DispSettings text
+EVENTS = 'events'           # input event processing
+
+PHASES = (BRIGHTNESS, CIRCUIT, CURRENT, DRAW, SETTINGS, EVENTS)
+
+WINDOW = 500                # durations kept per phase
+PERCENTILES = (50, 90, 99)
+
+
+class _Phase(object):
+
+    def __init__(self, durations):
+        self.durations = durations
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.durations.append(time.perf_counter() - self.start)
+
+
+class PhaseTimer(object):
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.durations = collections.OrderedDict((name, collections.deque(maxlen=window)) for name in PHASES)
+        self.phases = {}
+
+    # Context manager timing one pass through the named phase
+    def Phase(self, name):
+        phase = self.phases.get(name)
+        if phase is None:
+            durations = self.durations.setdefault(name, collections.deque(maxlen=self.window))
+            phase = self.phases[name] = _Phase(durations)
+        return phase
+
+    def Clear(self):
+        for durations in self.durations.values():
+            durations.clear()
+
+    # One row per phase that ran, times in ms over the rolling window
+    def Summary(self, percentiles=PERCENTILES):
+        rows = []
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            ms = np.array(durations) * 1000
+            row = collections.OrderedDict([('phase', name), ('count', len(ms)), ('mean_ms', ms.mean())])
+            for q, value in zip(percentiles, np.percentile(ms, percentiles)):
+                row['p%d_ms' % q] = value
+            rows.append(row)
+        return rows
+
+    # Overlay text, one line per phase
+    def Lines(self):
+        return ["%-10s %7.3f ms  p90 %7.3f ms" % (row['phase'], row['p50_ms'], row['p90_ms'])
+                for row in self.Summary((50, 90))]
+
+    # Write Summary() to path, as JSON if it ends in .json and CSV otherwise
+    def Dump(self, path):
+        rows = self.Summary()
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump(rows, f, indent=1)
+            else:
+                writer = csv.writer(f)
+                if rows:
+                    writer.writerow(list(rows[0]))
+                for row in rows:
+                    writer.writerow([round(v, 6) if isinstance(v, float) else v for v in row.values()])
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullTimer(object):
+
+    phase = _NullPhase()
+
+    def Phase(self, name):
+        return self.phase
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,151 @@
+
+#                                                       ABOUT
+
+# Board topology
+#       a board as node positions plus a weighted sensing graph, row i of the
+#       graph lists the nodes whose LEDs node i senses and how strongly, so the
+#       brightness sum of every node is one sparse matrix - vector product of
+#       the graph with iD
+
+# The graph is kept in CSR form (indptr, indices, weights) in plain numpy, a
+#       product is a gather of iD at indices and a sum over each row, tap by
+#       tap when the rows are all the same length, np.add.reduceat otherwise
+# Lattice() compiles the HEX / SQUARE grids and their brightness functions
+#       (B_3, B_6, B_4, B_hex, B_square) into this form once per board, with
+#       taps in stencil order so unweighted sums match the shifted array sums
+#       bit for bit. The lattice engines still sum with their stencils (see
+#       convolve.py), Lattice serves node lookups such as the game's NodeAt
+# FromPositions() builds one for any list of positions, an irregular or
+#       physically measured board, see engine.GraphEngine
+
+import numpy as np
+
+from .grid import LatticePositions, Stencil, StencilReach
+
+
+#                                                       CONSTANTS
+
+POSITION_TOLERANCE = 1e-9       # slack on distances when picking nodes within a radius
+PAIR_CHUNK = 1024               # nodes per block of the pairwise distances in FromPositions
+
+_lattices = {}
+
+
+class Topology(object):
+
+    # positions is an n x 2 array in dot spacings, None for a graph with no
+    #       layout (see StencilGraph), columns of the graph may run past n when
+    #       the rows are only part of the board
+    def __init__(self, indptr, indices, weights, positions=None):
+        self.indptr = np.asarray(indptr, dtype=np.intp)
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.weights = np.asarray(weights, dtype=float)
+        self.positions = None if positions is None else np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.n = len(self.indptr) - 1
+        self.unweighted = bool((self.weights == 1).all())
+
+        # reduceat gives an empty row the next row's first value, so only rows
+        #       that sense something are summed
+        self.sensing = np.flatnonzero(np.diff(self.indptr))
+        self.starts = self.indptr[self.sensing]
+
+        # taps of every sensing row when they all have the same number, None otherwise
+        lengths = np.diff(self.indptr)[self.sensing]
+        self.taps = int(lengths[0]) if len(lengths) and (lengths == lengths[0]).all() else None
+
+    # Light sensed by every node from the LED currents field[..., node], any
+    #       leading axes of field are carried along untouched
+    # Rows of equal length add their taps one at a time in order, as the
+    #       shifted array sums do, reduceat groups its additions differently
+    def Sense(self, field):
+        if not len(self.sensing):
+            return np.zeros(field.shape[:-1] + (self.n,))
+        values = field[..., self.indices]
+        if not self.unweighted:
+            values *= self.weights
+        if self.taps is None:
+            sums = np.add.reduceat(values, self.starts, axis=-1)
+        else:
+            values = values.reshape(values.shape[:-1] + (len(self.sensing), self.taps))
+            sums = values[..., 0].copy()
+            for k in range(1, self.taps):
+                sums += values[..., k]
+        if len(self.sensing) == self.n:
+            return sums
+        light = np.zeros(field.shape[:-1] + (self.n,))
+        light[..., self.sensing] = sums
+        return light
+
+    # Node nearest the position (x, y)
+    def Nearest(self, x, y):
+        return int(np.argmin((self.positions[:, 0] - x)**2 + (self.positions[:, 1] - y)**2))
+
+    # Nodes within distance r of the position (x, y)
+    def Within(self, x, y, r):
+        d2 = (self.positions[:, 0] - x)**2 + (self.positions[:, 1] - y)**2
+        return np.flatnonzero(d2 <= r * r + POSITION_TOLERANCE)
+
+
+# Topology from a list of edges, receiver senses sender with weight
+#       edges into the same receiver keep their order
+def FromEdges(n, receivers, senders, weights, positions=None):
+    receivers = np.asarray(receivers, dtype=np.intp)
+    order = np.argsort(receivers, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(receivers, minlength=n), out=indptr[1:])
+    return Topology(indptr, np.asarray(senders, dtype=np.intp)[order],
+                    np.asarray(weights, dtype=float)[order], positions)
+
+
+# Topology of nodes at arbitrary positions (n x 2, in dot spacings), each
+#       sensing every other node within reach weighted 1 / d^2, the distance
+#       law of grid.DistanceTable
+def FromPositions(positions, reach=1.0):
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    n = len(positions)
+    receivers, senders, weights = [], [], []
+    for start in range(0, n, PAIR_CHUNK):
+        block = positions[start:start + PAIR_CHUNK]
+        d2 = ((block[:, None, :] - positions[None, :, :])**2).sum(axis=-1)
+        rows, columns = np.nonzero((d2 > POSITION_TOLERANCE) & (d2 <= reach * reach + POSITION_TOLERANCE))
+        receivers.append(rows + start)
+        senders.append(columns)
+        weights.append(1.0 / d2[rows, columns])
+    return FromEdges(n, np.concatenate(receivers), np.concatenate(senders), np.concatenate(weights), positions)
+
+
+# Stencil taps of every node in the region (xs, ys) of a w x h board, as rows
+#       of [x][y] board indices and their weights, in stencil order
+def _StencilTaps(stencil, h, xs, ys):
+    x, y = np.mgrid[xs, ys]
+    x, y = x.ravel(), y.ravel()
+    taps = [(weight, dx, dy) for weight, offsets in stencil for dx, dy in offsets]
+    indices = np.empty((len(x), len(taps)), dtype=np.intp)
+    weights = np.empty(len(taps))
+    for k, (weight, dx, dy) in enumerate(taps):
+        indices[:, k] = (x + dx) * h + y + dy
+        weights[k] = weight
+    return x * h + y, indices, weights
+
+
+# Sensing graph of the region (xs, ys) of a board of shape (w, h) under a stencil
+#       one row per region node in [x][y] order, columns are board indices
+def StencilGraph(stencil, shape, xs, ys):
+    rows, indices, weights = _StencilTaps(stencil, shape[1], xs, ys)
+    taps = indices.shape[1]
+    return Topology(np.arange(len(rows) + 1) * taps, indices.ravel(), np.tile(weights, len(rows)))
+
+
+# A w x h HEX or SQUARE board under a brightness function, compiled once per
+#       board, interior nodes sense their stencil and the border senses nothing
+def Lattice(grid, bFn, w, h, psr):
+    key = (grid, bFn, w, h, psr)
+    if key not in _lattices:
+        stencil = Stencil(bFn, grid, psr)
+        if StencilReach(stencil) > psr:
+            raise ValueError("%s needs PSR >= %d" % (bFn, StencilReach(stencil)))
+        rows, indices, weights = _StencilTaps(stencil, h, slice(psr, w - psr), slice(psr, h - psr))
+        taps = indices.shape[1]
+        _lattices[key] = FromEdges(w * h, np.repeat(rows, taps), indices.ravel(), np.tile(weights, len(rows)),
+                                   LatticePositions(grid, w, h))
+    return _lattices[key]